@@ -0,0 +1,116 @@
+import math
+from bisect import bisect_left
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# All the functions take the curves as a flat sequence of cp1..cp4 as x, y, z: 12 values per curve,
+# and work on all of them at once. The lengths are in iso units, measured along chords.
+
+# Chords between two entries of a lookup table:
+TABLE_SUBSTEPS = 8
+# Chords per curve the resampled points are interpolated on:
+RESAMPLE_STEPS = 64
+
+
+def bernstein(t):
+    u = 1.0 - t
+    return (u * u * u, 3 * u * u * t, 3 * u * t * t, t * t * t)
+
+
+def sample_curves(points, steps):
+    """The points at t = 0, 1 / steps, ..., 1 of every curve and the cumulative chord lengths up to them.
+    NumPy arrays of (count, steps + 1, 3) and (count, steps + 1), nested lists without NumPy."""
+    count = len(points) // 12
+    if numpy is not None:
+        control_points = numpy.asarray(points, dtype=numpy.float64).reshape((count, 4, 3))
+        weights = numpy.stack(bernstein(numpy.linspace(0.0, 1.0, steps + 1)), axis=1) # (steps + 1, 4)
+        samples = numpy.matmul(weights, control_points) # (count, steps + 1, 3)
+        chords = numpy.linalg.norm(numpy.diff(samples, axis=1), axis=2)
+        cumulative = numpy.concatenate((numpy.zeros((count, 1)), numpy.cumsum(chords, axis=1)), axis=1)
+        return samples, cumulative
+
+    weights = [bernstein(step / steps) for step in range(steps + 1)]
+    samples = []
+    cumulative = []
+    for i in range(count):
+        p = points[i * 12:(i + 1) * 12]
+        curve_samples = [[w[0] * p[d] + w[1] * p[3 + d] + w[2] * p[6 + d] + w[3] * p[9 + d] for d in range(3)] for w in weights]
+        lengths = [0.0]
+        for a, b in zip(curve_samples, curve_samples[1:]):
+            lengths.append(lengths[-1] + math.dist(a, b))
+        samples.append(curve_samples)
+        cumulative.append(lengths)
+    return samples, cumulative
+
+
+def curve_lengths(points, steps=16):
+    if len(points) < 12:
+        return []
+    samples, cumulative = sample_curves(points, steps)
+    if numpy is not None:
+        return cumulative[:, -1].tolist()
+    return [lengths[-1] for lengths in cumulative]
+
+
+def arc_length_tables(points, samples=16):
+    """Per curve the arc length at t = 0, 1 / samples, ..., 1, the runtime inverts it to move at constant speed"""
+    if spacing <= 0:
+        raise ValueError("The resample spacing has to be greater than 0, got %g" % spacing)
+    if len(points) < 12:
+        return []
+    positions, cumulative = sample_curves(points, samples * TABLE_SUBSTEPS)
+    if numpy is not None:
+        return cumulative[:, ::TABLE_SUBSTEPS].tolist()
+    return [lengths[::TABLE_SUBSTEPS] for lengths in cumulative]
+
+
+def resample_curves(points, spacing, steps=RESAMPLE_STEPS):
+    """Per curve the points every spacing along it, from cp1 to cp4, the last interval can be shorter"""
+    if spacing <= 0:
+        raise ValueError("The resample spacing has to be greater than 0, got %g" % spacing)
+    if len(points) < 12:
+        return []
+    positions, cumulative = sample_curves(points, steps)
+    if numpy is None:
+        return [resample_curve(curve_positions, lengths, spacing) for curve_positions, lengths in zip(positions, cumulative)]
+
+    count = len(cumulative)
+    lengths = cumulative[:, -1]
+    # The distances along every curve in one flat array, each curve ends on its full length:
+    counts = numpy.floor(lengths / spacing).astype(numpy.int64) + 1
+    counts += lengths - (counts - 1) * spacing > spacing * 1e-6
+    curve_indices = numpy.repeat(numpy.arange(count), counts)
+    firsts = numpy.cumsum(counts) - counts
+    distances = numpy.minimum((numpy.arange(counts.sum()) - firsts[curve_indices]) * spacing, lengths[curve_indices])
+
+    # Offset every curve past the previous one, so a single search finds the chord of each distance:
+    offsets = numpy.arange(count) * (lengths.max() + 1.0)
+    flat = (cumulative + offsets[:, None]).reshape(-1)
+    targets = distances + offsets[curve_indices]
+    ends = numpy.clip(numpy.searchsorted(flat, targets), 1, None)
+    ends = numpy.maximum(ends, curve_indices * (steps + 1) + 1) # Distance 0 stays on the curve's first chord
+    starts = ends - 1
+    chord = flat[ends] - flat[starts]
+    fractions = numpy.where(chord > 0, (targets - flat[starts]) / numpy.where(chord > 0, chord, 1.0), 0.0)
+    flat_positions = positions.reshape((-1, 3))
+    resampled = flat_positions[starts] + (flat_positions[ends] - flat_positions[starts]) * fractions[:, None]
+    resampled = resampled.tolist()
+    return [resampled[first:first + size] for first, size in zip(firsts.tolist(), counts.tolist())]
+
+
+def resample_curve(positions, cumulative, spacing):
+    length = cumulative[-1]
+    distances = [i * spacing for i in range(int(length // spacing) + 1)]
+    if length - distances[-1] > spacing * 1e-6:
+        distances.append(length)
+    resampled = []
+    for distance in distances:
+        end = min(max(bisect_left(cumulative, distance), 1), len(cumulative) - 1)
+        start = end - 1
+        chord = cumulative[end] - cumulative[start]
+        fraction = (distance - cumulative[start]) / chord if chord > 0 else 0.0
+        resampled.append([a + (b - a) * fraction for a, b in zip(positions[start], positions[end])])
+    return resampled
@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+from argparse import ArgumentParser
+from PIL import Image
+from sprite_manifest import MANIFEST_FILENAME, read_sprite_descriptions
+
+ATLAS_VERSION = 1
+
+
+def next_power_of_two(value):
+    power = 1
+    while power < value:
+        power *= 2
+    return power
+
+
+class SkylinePacker:
+    """Bottom-left skyline packing of rectangles into a single sheet"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.skyline = [(0, 0, width)] # Segments of (x, y, width), left to right
+        self.used_width = 0
+        self.used_height = 0
+
+    def insert(self, width, height):
+        # Returns the (x, y) of the placed rectangle or None if it doesn't fit:
+        best = None
+        for index in range(len(self.skyline)):
+            y = self.fit(index, width, height)
+            if y is None:
+                continue
+            segment_width = self.skyline[index][2]
+            if best is None or (y + height, segment_width) < (best[1] + height, best[2]):
+                best = (index, y, segment_width)
+        if best is None:
+            return None
+
+        index, y, _ = best
+        x = self.skyline[index][0]
+        self.add_level(index, x, y, width, height)
+        self.used_width = max(self.used_width, x + width)
+        self.used_height = max(self.used_height, y + height)
+        return (x, y)
+
+    def fit(self, index, width, height):
+        x = self.skyline[index][0]
+        if x + width > self.width:
+            return None
+        y = 0
+        remaining = width
+        while remaining > 0:
+            y = max(y, self.skyline[index][1])
+            if y + height > self.height:
+                return None
+            remaining -= self.skyline[index][2]
+            index += 1
+        return y
+
+    def add_level(self, index, x, y, width, height):
+        self.skyline.insert(index, (x, y + height, width))
+
+        # Cut the segments covered by the new one:
+        end = x + width
+        index += 1
+        while index < len(self.skyline):
+            segment_x, segment_y, segment_width = self.skyline[index]
+            if segment_x >= end:
+                break
+            if segment_x + segment_width <= end:
+                del self.skyline[index]
+                continue
+            self.skyline[index] = (end, segment_y, segment_x + segment_width - end)
+            break
+
+        # Merge the neighbours on the same height:
+        merged = [self.skyline[0]]
+        for segment in self.skyline[1:]:
+            last = merged[-1]
+            if last[1] == segment[1]:
+                merged[-1] = (last[0], last[1], last[2] + segment[2])
+            else:
+                merged.append(segment)
+        self.skyline = merged
+
+
+def sprite_images(export_path, sprites):
+    # The sprites that have their image, paired with its filename:
+    images = []
+    for sprite in sprites:
+        image_filename = os.path.join(export_path, sprite["image"])
+        if not os.path.exists(image_filename):
+            continue
+        images.append((sprite, image_filename))
+    return images
+
+
+def pack_sprites(sizes, max_size, padding):
+    # Returns a list of (sheet index, x, y) for the sizes and the packers of the sheets.
+    order = sorted(range(len(sizes)), key=lambda i: (sizes[i][1], sizes[i][0]), reverse=True)
+    placements = [None] * len(sizes)
+    packers = []
+    for i in order:
+        width = sizes[i][0] + 2 * padding
+        height = sizes[i][1] + 2 * padding
+        for sheet_index, packer in enumerate(packers):
+            position = packer.insert(width, height)
+            if position is not None:
+                break
+        else:
+            # Oversized sprites get a sheet of their own:
+            sheet_size = max(max_size, next_power_of_two(max(width, height)))
+            packer = SkylinePacker(sheet_size, sheet_size)
+            packers.append(packer)
+            sheet_index = len(packers) - 1
+            position = packer.insert(width, height)
+        placements[i] = (sheet_index, position[0] + padding, position[1] + padding)
+    return placements, packers
+
+
+def build_atlas(export_path, sprites, max_size=2048, padding=1, name="atlas"):
+    """Packs the images of the sprites, the descriptions of one export, into sheets next to them"""
+    sprites = sprite_images(export_path, sprites)
+    # Deduplicated sprites share their image, it's packed only once:
+    images = list(dict.fromkeys(image_filename for _, image_filename in sprites))
+    # Only the headers are read here, thousands of open images would run out of file handles:
+    sizes = []
+    for image_filename in images:
+        with Image.open(image_filename) as image:
+            sizes.append(image.size)
+    placements, packers = pack_sprites(sizes, max_size, padding)
+
+    # Shrink the sheets to the smallest power of two holding everything:
+    sheets = []
+    for sheet_index, packer in enumerate(packers):
+        width = next_power_of_two(packer.used_width)
+        height = next_power_of_two(packer.used_height)
+        sheets.append({
+            "image": "%s_%d.png" % (name, sheet_index),
+            "width": width,
+            "height": height,
+        })
+    sheet_images = [Image.new("RGBA", (sheet["width"], sheet["height"]), (0, 0, 0, 0)) for sheet in sheets]
+
+    rects = {} # A map from image filename to its (sheet index, x, y, width, height)
+    for image_filename, size, placement in zip(images, sizes, placements):
+        sheet_index, x, y = placement
+        with Image.open(image_filename) as image:
+            sheet_images[sheet_index].paste(image.convert("RGBA"), (x, y))
+        rects[image_filename] = (sheet_index, x, y) + size
+
+    entries = []
+    for sprite, image_filename in sprites:
+        sheet_index, x, y, width, height = rects[image_filename]
+        sheet = sheets[sheet_index]
+        entries.append({
+            "name": sprite["name"],
+            "layer_name": sprite["layer_name"],
+            "location": sprite["location"],
+            "anchor": sprite["anchor"],
+            "size": sprite["size"],
+            "sheet": sheet_index,
+            "rect": {"x": x, "y": y, "width": width, "height": height},
+            "uv": {
+                "u0": x / sheet["width"],
+                "v0": y / sheet["height"],
+                "u1": (x + width) / sheet["width"],
+                "v1": (y + height) / sheet["height"],
+            },
+        })
+
+    for sheet, sheet_image in zip(sheets, sheet_images):
+        sheet_image.save(os.path.join(export_path, sheet["image"]), optimize=True)
+
+    manifest = {"version": ATLAS_VERSION, "sheets": sheets, "sprites": entries}
+    manifest_filename = os.path.join(export_path, name + ".json")
+    with open(manifest_filename, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == "__main__":
+    # Can be run on an existing export directory, no Inkscape needed:
+    parser = ArgumentParser(description="Pack exported ISO sprites into texture atlases")
+    parser.add_argument("export_path")
+    parser.add_argument("--max_size", type=int, default=2048)
+    parser.add_argument("--padding", type=int, default=1)
+    parser.add_argument("--manifest", action="store_true", help="Read the sprites from %s instead of the .spr files" % MANIFEST_FILENAME)
+    arguments = parser.parse_args()
+    sprites = read_sprite_descriptions(arguments.export_path, arguments.manifest)
+    manifest = build_atlas(arguments.export_path, sprites, arguments.max_size, arguments.padding)
+    sys.stdout.write("Packed %d sprites into %d sheets\n" % (len(manifest["sprites"]), len(manifest["sheets"])))
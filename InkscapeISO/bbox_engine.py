@@ -0,0 +1,210 @@
+import math
+import re
+import inkex
+from inkex.units import convert_unit
+import utils
+
+# Style properties which are inherited by the children and needed for the visual bounds:
+INHERITED_PROPERTIES = ("stroke", "stroke-width", "vector-effect", "marker-start", "marker-mid", "marker-end")
+MARKER_PROPERTIES = ("marker-start", "marker-mid", "marker-end")
+
+URL_REGEX = re.compile(r"url\(\s*['\"]?#([^'\")]+)['\"]?\s*\)")
+
+
+class VisualBoundingBoxEngine:
+    """Computes Inkscape-like visual bounding boxes (stroke, markers and clips included) without Inkscape"""
+
+    def __init__(self, svg, transforms=None):
+        self.svg = svg
+        self.transforms = transforms or utils.TransformCache(svg) # Usually the exporter's
+        self.inherited = {} # A map from element to the properties its children inherit
+
+    def composed_transform(self, element):
+        return self.transforms.composed(element)
+
+    def get_bounding_boxes(self, groups_ids):
+        bboxes_dict = {}
+        for group_id in groups_ids:
+            element = self.svg.getElementById(group_id)
+            box = self.visual_box(element)
+            if box is None:
+                bboxes_dict[group_id] = utils.BoundingBox(0.0, 0.0, 0.0, 0.0)
+                continue
+            x = self.transforms.to_pixels(box.left)
+            y = self.transforms.to_pixels(box.top)
+            width = self.transforms.to_pixels(box.width)
+            height = self.transforms.to_pixels(box.height)
+            bboxes_dict[group_id] = utils.BoundingBox(x, y, width, height)
+        return bboxes_dict
+
+    def visual_box(self, element):
+        parent = element.getparent()
+        return self.element_box(element, self.composed_transform(parent), self.inherited_from(parent))
+
+    def inherited_from(self, element):
+        # The properties collected down from the root, cached per ancestor like the transforms:
+        if element is None or not isinstance(element, inkex.BaseElement):
+            return {}
+        inherited = self.inherited.get(element)
+        if inherited is None:
+            inherited = self.inherit(element, self.inherited_from(element.getparent()))
+            self.inherited[element] = inherited
+        return inherited
+
+    def inherit(self, element, inherited):
+        style = element.cascaded_style()
+        result = dict(inherited)
+        for key in INHERITED_PROPERTIES:
+            value = style.get(key)
+            if value is not None and value != "inherit":
+                result[key] = value
+        return result
+
+    def element_box(self, element, parent_transform, inherited):
+        if isinstance(element, (inkex.ClipPath, inkex.Marker, inkex.Mask)):
+            return None
+        style = element.cascaded_style()
+        if style.get("display") == "none":
+            return None
+        inherited = self.inherit(element, inherited)
+        transform = parent_transform @ element.transform
+
+        box = None
+        if isinstance(element, inkex.Use):
+            referenced = element.href
+            if referenced is not None:
+                offset = inkex.Transform(translate=(
+                    convert_unit(element.get("x", "0"), "px"),
+                    convert_unit(element.get("y", "0"), "px"),
+                ))
+                if isinstance(referenced, inkex.Symbol):
+                    box = self.children_box(referenced, transform @ offset, inherited)
+                else:
+                    box = self.element_box(referenced, transform @ offset, inherited)
+        elif isinstance(element, (inkex.Group, inkex.Anchor, inkex.Switch)):
+            box = self.children_box(element, transform, inherited)
+        elif isinstance(element, (inkex.TextElement, inkex.FlowRoot)):
+            box = element.bounding_box(parent_transform)
+        elif isinstance(element, inkex.ShapeElement):
+            try:
+                path = element.path.to_absolute().transform(transform)
+            except NotImplementedError:
+                return None
+            box = path.bounding_box()
+            if box is not None and not isinstance(element, inkex.Image):
+                box = self.stroke_box(box, path, transform, inherited)
+
+        if box is None:
+            return None
+        return self.clip_box(box, element, style, transform)
+
+    def children_box(self, element, transform, inherited):
+        box = None
+        for child in element.iterchildren():
+            if not isinstance(child, inkex.BaseElement):
+                continue
+            child_box = self.element_box(child, transform, inherited)
+            if child_box is not None:
+                box += child_box
+        return box
+
+    def stroke_box(self, box, path, transform, inherited):
+        stroke = inherited.get("stroke")
+        if stroke is None or stroke == "none":
+            return box
+
+        stroke_width = self.stroke_width(inherited)
+        if inherited.get("vector-effect") == "non-scaling-stroke":
+            scale = 1.0
+        else:
+            scale = math.sqrt(abs(transform.a * transform.d - transform.b * transform.c))
+        half_width = stroke_width * scale / 2
+        box = inkex.BoundingBox(
+            (box.left - half_width, box.right + half_width),
+            (box.top - half_width, box.bottom + half_width),
+        )
+        return self.markers_box(box, path, stroke_width * scale, inherited)
+
+    def stroke_width(self, inherited):
+        try:
+            return convert_unit(inherited.get("stroke-width", "1"), "px")
+        except (ValueError, TypeError):
+            return 1.0
+
+    def markers_box(self, box, path, scaled_stroke_width, inherited):
+        vertices = list(path.end_points)
+        if not vertices:
+            return box
+        placements = {
+            "marker-start": vertices[:1],
+            "marker-mid": vertices[1:-1],
+            "marker-end": vertices[-1:],
+        }
+        for key in MARKER_PROPERTIES:
+            marker = self.referenced_element(inherited.get(key))
+            if marker is None:
+                continue
+            # The markers can be rotated, so the reach from the reference point is used in every direction:
+            reach = self.marker_reach(marker)
+            if marker.get("markerUnits", "strokeWidth") == "strokeWidth":
+                reach *= scaled_stroke_width
+            for vertex in placements[key]:
+                box += inkex.BoundingBox((vertex.x - reach, vertex.x + reach), (vertex.y - reach, vertex.y + reach))
+        return box
+
+    def marker_reach(self, marker):
+        marker_box = self.children_box(marker, marker.transform, {})
+        if marker_box is None:
+            return 0.0
+        ref_x = convert_unit(marker.get("refX", "0"), "px")
+        ref_y = convert_unit(marker.get("refY", "0"), "px")
+        return max(
+            math.hypot(corner_x - ref_x, corner_y - ref_y)
+            for corner_x in (marker_box.left, marker_box.right)
+            for corner_y in (marker_box.top, marker_box.bottom)
+        )
+
+    def clip_box(self, box, element, style, transform):
+        clip = self.referenced_element(style.get("clip-path") or element.get("clip-path"))
+        if clip is None:
+            return box
+        # The clip path geometry (no stroke) is in the user space of the clipped element:
+        clip_box = None
+        for child in clip.iterchildren():
+            if isinstance(child, inkex.ShapeElement):
+                child_box = child.shape_box(transform @ clip.transform)
+                if child_box is not None:
+                    clip_box += child_box
+        if clip_box is None:
+            return box
+        clipped = box & clip_box
+        if clipped.width < 0 or clipped.height < 0:
+            return None
+        return clipped
+
+    def referenced_element(self, value):
+        if not value:
+            return None
+        match = URL_REGEX.search(value)
+        if match is None:
+            return None
+        return self.svg.getElementById(match.group(1))
+
+
+def compare_bounding_boxes(expected, actual, tolerance):
+    """Returns the ids of the boxes which differ by more than the tolerance (in pixels)"""
+    mismatched = []
+    for group_id, expected_box in expected.items():
+        actual_box = actual.get(group_id)
+        if actual_box is None:
+            mismatched.append(group_id)
+            continue
+        difference = max(
+            abs(expected_box.x - actual_box.x),
+            abs(expected_box.y - actual_box.y),
+            abs(expected_box.width - actual_box.width),
+            abs(expected_box.height - actual_box.height),
+        )
+        if difference > tolerance:
+            mismatched.append(group_id)
+    return mismatched
@@ -0,0 +1,141 @@
+import sys
+import random
+from argparse import ArgumentParser
+
+SVG_HEADER = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<svg
+   xmlns="http://www.w3.org/2000/svg"
+   xmlns:svg="http://www.w3.org/2000/svg"
+   xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"
+   xmlns:sodipodi="http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"
+   id="svg8" version="1.1" width="%(width)d" height="%(height)d" viewBox="0 0 %(width)d %(height)d">
+"""
+
+TAGS = ("road", "rail", "river")
+
+
+class WorldGenerator:
+    """Reproducible synthetic isometric worlds, the same seed gives the same document"""
+
+    def __init__(self, groups=100, depth=2, layers=3, transform_chain=2, curves=50, segments=8,
+            shapes=4, width=4096, height=4096, seed=0):
+        self.groups = groups
+        self.depth = depth
+        self.layers = layers
+        self.transform_chain = transform_chain
+        self.curves = curves
+        self.segments = segments
+        self.shapes = shapes
+        self.width = width
+        self.height = height
+        self.random = random.Random(seed)
+        self.next_id = 0
+
+    def new_id(self, prefix):
+        self.next_id += 1
+        return "%s%d" % (prefix, self.next_id)
+
+    def transform(self):
+        # A chain of small transforms, like the ones nested layers and moved groups pick up:
+        operations = []
+        for i in range(self.transform_chain):
+            kind = self.random.choice(("translate", "scale", "rotate"))
+            if kind == "translate":
+                operations.append("translate(%.3f,%.3f)" % (self.random.uniform(-20, 20), self.random.uniform(-20, 20)))
+            elif kind == "scale":
+                operations.append("scale(%.4f)" % self.random.uniform(0.9, 1.1))
+            else:
+                operations.append("rotate(%.3f)" % self.random.uniform(-3, 3))
+        return " ".join(operations)
+
+    def shape(self, x, y):
+        size = self.random.uniform(10, 60)
+        color = "#%06x" % self.random.randrange(0xffffff)
+        if self.random.random() < 0.5:
+            return '<rect id="%s" x="%.3f" y="%.3f" width="%.3f" height="%.3f" style="fill:%s;stroke:#000000;stroke-width:%.2f" />' % (
+                self.new_id("rect"), x, y, size, size / 2, color, self.random.uniform(0.5, 3))
+        return '<path id="%s" d="M %.3f,%.3f l %.3f,%.3f l %.3f,%.3f z" style="fill:%s;stroke:none" />' % (
+            self.new_id("path"), x, y, size, size / 2, -size, size / 2, color)
+
+    def iso_group(self, number, x, y):
+        z = self.random.choice((0.0, 0.0, 0.0, 1.0, 2.0))
+        origin_name = "[ISO ORIGIN][#%d][Z=%.4f]" % (number, z)
+        parts = ['<g id="%s" inkscape:label="sprite %d" transform="%s">' % (self.new_id("g"), number, self.transform())]
+        for i in range(self.shapes):
+            parts.append(self.shape(x + self.random.uniform(-40, 40), y + self.random.uniform(-40, 40)))
+        parts.append('<circle id="%s" inkscape:label="%s" cx="%.3f" cy="%.3f" r="4" style="display:inline;fill:#ff0000" />' % (
+            origin_name, origin_name, x, y))
+        parts.append("</g>")
+        return "".join(parts)
+
+    def curve(self):
+        x = self.random.uniform(0, self.width)
+        y = self.random.uniform(0, self.height)
+        d = ["M %.3f,%.3f" % (x, y)]
+        for i in range(self.segments):
+            if self.random.random() < 0.5:
+                d.append("L %.3f,%.3f" % (x + self.random.uniform(-50, 50), y + self.random.uniform(-50, 50)))
+            else:
+                d.append("C %.3f,%.3f %.3f,%.3f %.3f,%.3f" % tuple(
+                    value + self.random.uniform(-50, 50) for value in (x, y, x, y, x, y)))
+        label = "curve [tags=%s]" % self.random.choice(TAGS)
+        style = "fill:none;stroke:#0000ff;stroke-width:2"
+        if self.random.random() < 0.3:
+            style += ";marker-start:url(#Square);marker-end:url(#Triangle)"
+        return '<path id="%s" inkscape:label="%s" d="%s" style="%s" />' % (self.new_id("curve"), label, " ".join(d), style)
+
+    def generate(self):
+        parts = [SVG_HEADER % {"width": self.width, "height": self.height}]
+        number = 1
+        per_layer = [self.groups // self.layers + (1 if i < self.groups % self.layers else 0) for i in range(self.layers)]
+        for layer_index, count in enumerate(per_layer):
+            parts.append('<g id="%s" inkscape:groupmode="layer" inkscape:label="Layer %d">' % (self.new_id("layer"), layer_index))
+            for i in range(count):
+                x = self.random.uniform(0, self.width)
+                y = self.random.uniform(0, self.height)
+                # Plain groups between the layer and the sprite:
+                for level in range(self.depth):
+                    parts.append('<g id="%s" transform="%s">' % (self.new_id("g"), self.transform()))
+                parts.append(self.iso_group(number, x, y))
+                parts.append("</g>" * self.depth)
+                number += 1
+            parts.append("</g>")
+
+        parts.append('<g id="%s" inkscape:groupmode="layer" inkscape:label="Curves">' % self.new_id("layer"))
+        for i in range(self.curves):
+            parts.append(self.curve())
+        parts.append("</g>")
+        parts.append("</svg>\n")
+        return "\n".join(parts)
+
+    def write(self, filename):
+        with open(filename, "w") as f:
+            f.write(self.generate())
+        return filename
+
+
+def add_generator_arguments(parser):
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--layers", type=int, default=3)
+    parser.add_argument("--transform_chain", type=int, default=2)
+    parser.add_argument("--curves", type=int, default=50)
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def generator_from_options(options):
+    return WorldGenerator(
+        groups=options.groups, depth=options.depth, layers=options.layers,
+        transform_chain=options.transform_chain, curves=options.curves,
+        segments=options.segments, seed=options.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Generate a synthetic isometric world SVG")
+    parser.add_argument("output")
+    add_generator_arguments(parser)
+    options = parser.parse_args()
+    generator_from_options(options).write(options.output)
+    sys.stdout.write("Written %s\n" % options.output)
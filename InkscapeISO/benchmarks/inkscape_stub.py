@@ -0,0 +1,49 @@
+import sys
+import zlib
+import struct
+
+# Stands in for `inkscape --shell` so the export runs without Inkscape installed.
+# Queries answer a unit box and every export writes a 1x1 transparent PNG.
+
+PROMPT = "> "
+
+
+def png_bytes():
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+    header = struct.pack(">IIBBBBB", 1, 1, 8, 6, 0, 0, 0)
+    pixels = zlib.compress(b"\0\0\0\0\0")
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", pixels) + chunk(b"IEND", b"")
+
+
+def main():
+    if "--shell" not in sys.argv:
+        sys.stderr.write("Only the shell mode is stubbed\n")
+        return 1
+
+    image = png_bytes()
+    state = {}
+    out = sys.stdout
+    out.write("Inkscape interactive shell mode (stub)\n" + PROMPT)
+    out.flush()
+    for line in sys.stdin:
+        for action in line.split(";"):
+            name, _, argument = action.strip().partition(":")
+            if name == "quit":
+                return 0
+            if name in ("query-x", "query-y"):
+                out.write("0\n")
+            elif name in ("query-width", "query-height"):
+                out.write("1\n")
+            elif name == "export-do":
+                with open(state["export-filename"], "wb") as f:
+                    f.write(image)
+            elif name:
+                state[name] = argument
+        out.write(PROMPT)
+        out.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import statistics
+import tempfile
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inkex
+import utils
+from iso_index import IsoIndex
+from bbox_engine import VisualBoundingBoxEngine
+from export_iso_sprite import ExportIsoSprite
+from export_iso_curves import ExportIsoCurves
+from generate_world import add_generator_arguments, generator_from_options
+
+REPORT_VERSION = 1
+
+
+def stub_command(directory):
+    # A wrapper script, so the stub runs with this interpreter whatever is on the PATH:
+    stub = os.path.join(os.path.dirname(os.path.abspath(__file__)), "inkscape_stub.py")
+    command = os.path.join(directory, "inkscape")
+    with open(command, "w") as f:
+        f.write('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, stub))
+    os.chmod(command, 0o755)
+    return command
+
+
+class Timer:
+    def __init__(self):
+        self.phases = {}
+
+    def measure(self, phase, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.phases.setdefault(phase, []).append(time.perf_counter() - start)
+        return result
+
+
+def run_once(timer, document, export_path):
+    extension = ExportIsoSprite()
+    extension.parse_arguments([document, "--export_path=" + export_path])
+    timer.measure("document_parse", extension.load_raw)
+    root = extension.document.getroot()
+
+    extension.index = timer.measure("origin_index", IsoIndex, root)
+    extension.transforms = utils.TransformCache(extension.svg)
+    timer.measure("transform_cache", extension.transforms.fill, root)
+
+    groups = {}
+    def add_group(group):
+        groups[group.get_id()] = group
+    def visit_nodes():
+        for node in root:
+            extension.visit_node(node, add_group)
+    timer.measure("visit_node", visit_nodes)
+
+    names_counts = {}
+    for group in groups.values():
+        group.name = extension.get_group_name(names_counts, group)
+        group.layer_name = extension.get_object_layer_name(group)
+        group.image_name = group.name
+
+    def find_origins():
+        return {group_id: extension.get_iso_origin(group) for group_id, group in groups.items()}
+    origins = timer.measure("origin_lookup", find_origins)
+
+    engine = VisualBoundingBoxEngine(extension.svg, extension.transforms)
+    bboxes = timer.measure("bbox", engine.get_bounding_boxes, list(groups.keys()))
+
+    def write_spr_files():
+        locations = extension.get_iso_locations(origins)
+        for group_id, group in groups.items():
+            extension.write_spr_file(extension.get_sprite(group, bboxes[group_id], origins[group_id], locations[group_id]))
+    timer.measure("write_spr_file", write_spr_files)
+
+    # The curve control points, as ExportIsoCurves collects them:
+    paths = [element for element in root.iter() if isinstance(element, inkex.PathElement) and element.get("inkscape:label")]
+    positions_x = []
+    positions_y = []
+    for path in paths:
+        for proxy in path.path.proxy_iterator():
+            for control_point in proxy.control_points:
+                positions_x.append(control_point.x)
+                positions_y.append(control_point.y)
+    timer.measure("curve_unprojection", utils.unproject_many, positions_x, positions_y, 0.0, 128, 64, 128)
+
+    extension.clean_up()
+    return {"groups": len(groups), "curves": len(paths), "control_points": len(positions_x)}
+
+
+def run_extensions(timer, document, export_path):
+    # The complete runs, with the Inkscape calls going to whatever INKSCAPE_COMMAND is:
+    def export_sprites():
+        with open(os.devnull, "wb") as output:
+            ExportIsoSprite().run([document, "--export_path=" + export_path], output=output)
+    timer.measure("sprite_export", export_sprites)
+
+    svg = inkex.load_svg(document).getroot()
+    curves_ids = [element.get("id") for element in svg.iter() if isinstance(element, inkex.PathElement) and element.get("inkscape:label")]
+    curves_path = os.path.join(export_path, "curves.json")
+    def export_curves():
+        arguments = [document, "--export_path=" + curves_path, "--search_scope=selection"]
+        with open(os.devnull, "wb") as output:
+            ExportIsoCurves().run(arguments + ["--id=" + curve_id for curve_id in curves_ids], output=output)
+    timer.measure("curve_export", export_curves)
+
+
+def summarize(phases):
+    return {
+        phase: {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+        for phase, runs in phases.items()
+    }
+
+
+def compare(report, previous_filename):
+    with open(previous_filename, "r") as f:
+        previous = json.load(f)
+    for phase, result in report["phases"].items():
+        if phase not in previous["phases"]:
+            continue
+        before = previous["phases"][phase]["median"]
+        ratio = result["median"] / before if before else float("inf")
+        sys.stdout.write("%-20s %10.4fs -> %10.4fs  x%.2f\n" % (phase, before, result["median"], ratio))
+
+
+def main():
+    parser = ArgumentParser(description="Time the phases of the ISO export on a synthetic world")
+    add_generator_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--report", default="benchmark_report.json")
+    parser.add_argument("--compare", default=None, help="A previous report to compare the medians with")
+    parser.add_argument("--inkscape", action="store_true", help="Use the real Inkscape instead of the stub")
+    options = parser.parse_args()
+    if options.repeat < 1:
+        parser.error("--repeat needs at least one run, the report has nothing to show otherwise")
+
+    work_directory = tempfile.mkdtemp(prefix="iso_benchmark")
+    try:
+        if not options.inkscape:
+            utils.INKSCAPE_COMMAND = stub_command(work_directory)
+
+        document = generator_from_options(options).write(os.path.join(work_directory, "world.svg"))
+        timer = Timer()
+        for i in range(options.repeat):
+            export_path = os.path.join(work_directory, "export%d" % i)
+            os.makedirs(export_path)
+            counts = run_once(timer, document, export_path)
+            run_extensions(timer, document, export_path)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    report = {
+        "version": REPORT_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "inkscape": "real" if options.inkscape else "stub",
+        "parameters": {
+            "groups": options.groups, "depth": options.depth, "layers": options.layers,
+            "transform_chain": options.transform_chain, "curves": options.curves,
+            "segments": options.segments, "seed": options.seed, "repeat": options.repeat,
+        },
+        "counts": counts,
+        "phases": summarize(timer.phases),
+    }
+    with open(options.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for phase, result in report["phases"].items():
+        sys.stdout.write("%-20s %10.4fs\n" % (phase, result["median"]))
+    if options.compare:
+        compare(report, options.compare)
+
+
+if __name__ == "__main__":
+    main()
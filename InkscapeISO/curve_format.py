@@ -0,0 +1,178 @@
+import json
+import struct
+from array import array
+
+from mapped_file import MappedFile, align, write_array, write_strings, numpy
+
+# Binary ISO curves file, all little-endian:
+#   header      - see HEADER below, offsets are from the start of the file
+#   points      - per curve cp1..cp4 as x, y, z: 12 float32 (or float64, see FLAG_DOUBLE_PRECISION)
+#   flags       - per curve one byte of the CURVE_* bits
+#   tag ids     - per curve an int32 index into the tag table, -1 for no tags
+#   tag table   - per tag an uint32 byte length followed by the utf-8 bytes
+# Sections are 8-byte aligned so they can be mapped straight into arrays.
+MAGIC = b"ISOC"
+VERSION = 1
+BINARY_EXTENSION = ".isoc"
+HEADER = struct.Struct("<4sHHIIQQQQ") # magic, version, file flags, curve count, tag count, 4 section offsets
+
+FLAG_DOUBLE_PRECISION = 1
+
+CURVE_START = 1
+CURVE_END = 2
+CURVE_FORWARD = 4
+CURVE_HAS_FORWARD = 8
+
+CONTROL_POINTS = ("cp1", "cp2", "cp3", "cp4")
+NO_TAGS = -1
+
+
+class CurveWriter:
+    """Writes the curves one by one, only the flags and tag ids are kept until close()"""
+
+    def __init__(self, filename, double_precision=False):
+        self.file = open(filename, "wb")
+        self.file_flags = FLAG_DOUBLE_PRECISION if double_precision else 0
+        self.points = struct.Struct("<12d" if double_precision else "<12f")
+        self.flags = bytearray()
+        self.tag_ids = array("i")
+        self.tags = {} # A map from the tags string to its index
+        self.file.write(b"\0" * HEADER.size) # Filled in on close()
+        self.points_offset = align(self.file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, curve):
+        coordinates = []
+        for name in CONTROL_POINTS:
+            control_point = curve[name]
+            coordinates += (control_point["x"], control_point["y"], control_point["z"])
+        self.file.write(self.points.pack(*coordinates))
+
+        flags = 0
+        if curve.get("start"):
+            flags |= CURVE_START
+        if curve.get("end"):
+            flags |= CURVE_END
+        if "forward" in curve:
+            flags |= CURVE_HAS_FORWARD
+            if curve["forward"]:
+                flags |= CURVE_FORWARD
+        self.flags.append(flags)
+
+        tags = curve.get("tags")
+        if tags is None:
+            self.tag_ids.append(NO_TAGS)
+        else:
+            self.tag_ids.append(self.tags.setdefault(tags, len(self.tags)))
+
+    def close(self):
+        if self.file is None:
+            return
+        flags_offset = align(self.file)
+        self.file.write(self.flags)
+        tag_ids_offset = align(self.file)
+        write_array(self.file, self.tag_ids)
+        tag_table_offset = align(self.file)
+        write_strings(self.file, self.tags) # Insertion ordered, so in the order of the indices
+
+        self.file.seek(0)
+        self.file.write(HEADER.pack(
+            MAGIC, VERSION, self.file_flags, len(self.flags), len(self.tags),
+            self.points_offset, flags_offset, tag_ids_offset, tag_table_offset,
+        ))
+        self.file.close()
+        self.file = None
+
+
+class JsonCurveWriter:
+    """Writes the curves one by one as the same JSON list that json.dump(curves, indent=2) writes"""
+
+    def __init__(self, filename):
+        self.file = open(filename, "w")
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, curve):
+        self.file.write("[\n  " if self.count == 0 else ",\n  ")
+        self.file.write(json.dumps(curve, indent=2).replace("\n", "\n  "))
+        self.count += 1
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.write("\n]" if self.count else "[]")
+        self.file.close()
+        self.file = None
+
+
+def write_curves(filename, curves, double_precision=False):
+    with CurveWriter(filename, double_precision) as writer:
+        for curve in curves:
+            writer.write(curve)
+
+
+class CurveFile(MappedFile):
+    """Memory-mapped binary curves. With NumPy, points is an (n, 4, 3) array viewing the file."""
+
+    ARRAYS = ("points", "flags", "tag_ids")
+
+    def __init__(self, filename):
+        MappedFile.__init__(self, filename)
+        (magic, version, file_flags, self.count, tag_count,
+            points_offset, flags_offset, tag_ids_offset, tag_table_offset) = HEADER.unpack_from(self.mapping, 0)
+        if magic != MAGIC:
+            raise ValueError("Not an ISO curves file: %s" % filename)
+        if version > VERSION:
+            raise ValueError("Unsupported ISO curves file version %d" % version)
+
+        double_precision = file_flags & FLAG_DOUBLE_PRECISION
+        self.points = self.array(points_offset, self.count * 12, "d" if double_precision else "f")
+        if numpy is not None:
+            self.points = self.points.reshape((self.count, 4, 3))
+        self.flags = self.array(flags_offset, self.count, "B")
+        self.tag_ids = self.array(tag_ids_offset, self.count, "i")
+        self.tags = self.strings(tag_table_offset, tag_count)
+
+    def __len__(self):
+        return self.count
+
+    def curve(self, index):
+        """The curve as the same dict that the JSON export writes"""
+        if numpy is not None:
+            coordinates = self.points[index].reshape(12).tolist()
+        else:
+            coordinates = self.points[index * 12:(index + 1) * 12].tolist()
+        curve = {}
+        for i, name in enumerate(CONTROL_POINTS):
+            x, y, z = coordinates[i * 3:i * 3 + 3]
+            curve[name] = {"x": x, "y": y, "z": z}
+
+        flags = int(self.flags[index])
+        if flags & CURVE_START:
+            curve["start"] = True
+        if flags & CURVE_HAS_FORWARD:
+            curve["forward"] = bool(flags & CURVE_FORWARD)
+        tag_id = int(self.tag_ids[index])
+        if tag_id != NO_TAGS:
+            curve["tags"] = self.tags[tag_id]
+        if flags & CURVE_END:
+            curve["end"] = "end"
+        return curve
+
+    def curves(self):
+        return [self.curve(index) for index in range(self.count)]
+
+
+def read_curves(filename):
+    with CurveFile(filename) as curve_file:
+        return curve_file.curves()
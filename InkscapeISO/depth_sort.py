@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import heapq
+import statistics
+from argparse import ArgumentParser
+
+from sprite_manifest import read_sprite_descriptions
+from spatial_index import sprite_footprint
+
+DRAW_ORDER_FILENAME = "draw_order.json"
+DRAW_ORDER_VERSION = 1
+
+# Iso depths (x + y) closer than this are treated as the same row:
+DEPTH_EPSILON = 1e-6
+
+
+def overlapping_pairs(boxes):
+    """The (i, j) pairs, i < j, of boxes whose interiors overlap, found through a uniform grid"""
+    if not boxes:
+        return []
+    # Cells about the size of a typical box, so each box lands in a few cells only:
+    cell_size = statistics.median(max(box[2] - box[0], box[3] - box[1]) for box in boxes) or 1.0
+    cells = {}
+    for i, box in enumerate(boxes):
+        for cell_x in range(int(box[0] // cell_size), int(box[2] // cell_size) + 1):
+            for cell_y in range(int(box[1] // cell_size), int(box[3] // cell_size) + 1):
+                cells.setdefault((cell_x, cell_y), []).append(i)
+
+    pairs = set()
+    for members in cells.values():
+        for a in range(len(members)):
+            i = members[a]
+            box = boxes[i]
+            for b in range(a + 1, len(members)):
+                j = members[b]
+                other = boxes[j]
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    pairs.add((i, j) if i < j else (j, i))
+    return sorted(pairs)
+
+
+def sort_key(sprite, box):
+    # Further back rows first, then lower z, then the higher bottom edge on the screen:
+    location = sprite["location"]
+    return (location["x"] + location["y"], location["z"], box[3], sprite["name"])
+
+
+def in_front(key, other_key):
+    if abs(key[0] - other_key[0]) > DEPTH_EPSILON:
+        return key[0] > other_key[0]
+    return key[1:] > other_key[1:]
+
+
+def draw_order(sprites, boxes):
+    """Indices of the sprites in back to front order, only the overlapping sprites constrain each other.
+    Returns the order and the number of cycles that had to be broken."""
+    keys = [sort_key(sprite, box) for sprite, box in zip(sprites, boxes)]
+    behind = [[] for sprite in sprites] # Per sprite the sprites drawn after it
+    blockers = [0] * len(sprites)
+    for i, j in overlapping_pairs(boxes):
+        back, front = (j, i) if in_front(keys[i], keys[j]) else (i, j)
+        behind[back].append(front)
+        blockers[front] += 1
+
+    # Kahn's algorithm, the free sprites come out in the key order so the result is stable:
+    ready = [(keys[i], i) for i in range(len(sprites)) if blockers[i] == 0]
+    heapq.heapify(ready)
+    order = []
+    done = [False] * len(sprites)
+    cycles = 0
+    while len(order) < len(sprites):
+        if not ready:
+            # The epsilon ties can form a cycle, the backmost remaining sprite breaks it:
+            cycles += 1
+            i = min((i for i in range(len(sprites)) if not done[i]), key=lambda i: keys[i])
+            blockers[i] = 0
+            heapq.heappush(ready, (keys[i], i))
+        key, i = heapq.heappop(ready)
+        if done[i]:
+            continue
+        done[i] = True
+        order.append(i)
+        for front in behind[i]:
+            blockers[front] -= 1
+            if blockers[front] == 0 and not done[front]:
+                heapq.heappush(ready, (keys[front], front))
+    return order, cycles
+
+
+def write_draw_order(export_path, sprites, htw, hth, v_step, dpi):
+    """Writes the per-layer draw orders of the sprites, sorted by name, as indices into their names.
+    Returns the filename."""
+    layers = {} # A map from layer name to the indices of its sprites
+    for i, sprite in enumerate(sprites):
+        layers.setdefault(sprite["layer_name"], []).append(i)
+
+    orders = {}
+    cycles = 0
+    for layer_name, indices in layers.items():
+        layer_sprites = [sprites[i] for i in indices]
+        boxes = [sprite_footprint(sprite, htw, hth, v_step, dpi) for sprite in layer_sprites]
+        order, layer_cycles = draw_order(layer_sprites, boxes)
+        orders[layer_name] = [indices[i] for i in order]
+        cycles += layer_cycles
+
+    filename = os.path.join(export_path, DRAW_ORDER_FILENAME)
+    with open(filename + ".tmp", "w") as f:
+        json.dump({
+            "version": DRAW_ORDER_VERSION,
+            "sprites": [sprite["name"] for sprite in sprites],
+            "layers": orders,
+            "cycles": cycles,
+        }, f)
+    os.replace(filename + ".tmp", filename)
+    return filename
+
+
+if __name__ == "__main__":
+    # Can be run on an existing export directory, no Inkscape needed:
+    parser = ArgumentParser(description="Precompute the back to front draw order of exported ISO sprites")
+    parser.add_argument("export_path")
+    parser.add_argument("--tile_width", type=int, default=256)
+    parser.add_argument("--tile_height", type=int, default=128)
+    parser.add_argument("--vertical_step", type=int, default=128)
+    parser.add_argument("--export_dpi", type=float, default=96.0)
+    parser.add_argument("--manifest", action="store_true", help="Read the sprites from the manifest instead of the .spr files")
+    arguments = parser.parse_args()
+    sprites = read_sprite_descriptions(arguments.export_path, arguments.manifest)
+    filename = write_draw_order(arguments.export_path, sprites, arguments.tile_width / 2, arguments.tile_height / 2,
+        arguments.vertical_step, arguments.export_dpi)
+    sys.stdout.write("Written %s\n" % filename)
@@ -3,16 +3,23 @@ import os
 import re
 
 running_in_inkscape = "Inkscape" in sys.executable
-if not running_in_inkscape:
+if not running_in_inkscape and os.name == "nt":
     sys.path.append("C:\\Program Files\\Inkscape\\share\\inkscape\\extensions")
-    os.environ["PATH"] += "C:\\Program Files\\Inkscape\\bin"
+    os.environ["PATH"] += os.pathsep + "C:\\Program Files\\Inkscape\\bin"
 
 
 from argparse import ArgumentParser
-from typing import Any, List
+from typing import Any
 import inkex
 import utils
-import json
+import curve_format
+import nav_graph
+import arc_length
+from instrumentation import recorder
+from iso_index import IsoIndex
+
+# Paths are unprojected and written in batches of about this many control points:
+BATCH_CONTROL_POINTS = 65536
 
 class ExportIsoCurves(inkex.EffectExtension):
 
@@ -22,6 +29,15 @@ class ExportIsoCurves(inkex.EffectExtension):
           # Export settings
         pars.add_argument("--export_path", type=str, default="")
         pars.add_argument("--search_scope", type=str, default="auto")
+        pars.add_argument("--export_format", type=str, default="json")
+        pars.add_argument("--double_precision", type=inkex.Boolean, default=False)
+        pars.add_argument("--layer", type=str, default="")
+        pars.add_argument("--tags_filter", type=str, default="")
+        pars.add_argument("--nav_graph", type=inkex.Boolean, default=False)
+        pars.add_argument("--nav_tolerance", type=float, default=0.01)
+        pars.add_argument("--arc_length", type=str, default="off")
+        pars.add_argument("--arc_length_samples", type=int, default=16)
+        pars.add_argument("--resample_spacing", type=float, default=0.25)
 
         # World settings:
         pars.add_argument("--world_center", type=str, default="page")
@@ -31,12 +47,20 @@ class ExportIsoCurves(inkex.EffectExtension):
         pars.add_argument("--tile_height", type=int, default=128)
         pars.add_argument("--vertical_step", type=int, default=128)
         pars.add_argument("--z_value", type=float, default=0.0)
+        pars.add_argument("--instrumentation", type=str, default="off")
         
 
     def effect(self) -> Any:
+        recorder.start(self.options.instrumentation)
+        try:
+            return self.export_curves()
+        finally:
+            recorder.finish(os.path.splitext(self.options.export_path)[0] + "_report")
+
+
+    def export_curves(self):
         # Read the paremeters:
         export_path = self.options.export_path
-        search_scope = self.options.search_scope
 
         world_center = self.options.world_center
         if world_center == "page":
@@ -50,85 +74,161 @@ class ExportIsoCurves(inkex.EffectExtension):
         v_step = self.options.vertical_step
         z_value = self.options.z_value
 
-        if not running_in_inkscape:
-            selected_paths_ids = ["path58", "path44", "path3"]
-            # selected_paths_ids = ["path46"]
-            selected_paths = [self.svg.getElementById(path_id) for path_id in selected_paths_ids]
-            # self.svg.selection.set(*selected_paths)
-
         # self.msg(self.options.search_scope)
 
-        if self.options.search_scope == "auto":
-            objects = self.svg.selection.values() if self.svg.selection else self.document.getroot()
-        elif self.options.search_scope == "everything":
-            objects = self.document.getroot()
-            raise Exception("Exporting everything to paths not supported")
-        else:
-            objects = self.svg.selection.values()
+        # The binary format has no room for them, they would be dropped without a word:
+        if self.options.arc_length != "off" and self.options.export_format == "binary":
+            raise inkex.AbortExtension("The arc lengths are only written to the JSON export, choose the JSON or both formats.")
+        # The .inx has a minimum, the batch runs don't go through it:
+        if self.options.arc_length in ("resample", "both") and self.options.resample_spacing <= 0:
+            raise inkex.AbortExtension("The resample spacing has to be greater than 0, got %g." % self.options.resample_spacing)
+
+        if self.options.search_scope == "selection" or (self.options.search_scope == "auto" and self.svg.selection):
+            objects = list(self.svg.selection.values())
             if len(objects) == 0: 
                 self.msg("Search scope is \"selection\" but nothing selected.")
                 return
-        
-        # All the paths that are going to be exported:
-        paths = []
-        # Paths related data:
-        paths_data = []
-        for object in objects:
-            # self.msg(type(object))
-            if isinstance(object, inkex.PathElement):
-                label = object.get("inkscape:label")
-                tags = None
-                if label:
-                    m = re.match(r".*\[tags=(.*)\]", label)
-                    if m:
-                        tags = m.group(1)
-
-                path = object.get_path()
-                paths.append(path)
-
-                start_style = object.style.get("marker-start")
-                end_style = object.style.get("marker-end")
-
-                if not start_style:
-                    start = ""
-                else:
-                    start = "start" if "Square" in start_style else ""
+        else: # Everything
+            objects = [self.document.getroot()]
 
-                if not end_style:
-                    direction = "forward"
-                    end = ""
-                else:
-                    direction = "forward" if "Triangle" in end_style else "reverse"
-                    end = "end" if "Square" in end_style else ""
+        self.transforms = utils.TransformCache(self.svg)
+        self.index = IsoIndex(self.document.getroot())
+        self.world_center = (world_center_x, world_center_y)
+        self.iso_settings = (z_value, htw, hth, v_step)
 
-                data = {
-                    "id" : object.get_id(),
-                    "tags": tags,
-                    "start": start,
-                    "direction": direction,
-                    "end": end
-                }
+        # The curves go straight to the files, batch by batch, so nothing grows with the document:
+        writers = []
+        export_format = self.options.export_format
+        if export_format in ("json", "both"):
+            writers.append((export_path, curve_format.JsonCurveWriter(export_path)))
+        if export_format in ("binary", "both"):
+            binary_path = os.path.splitext(export_path)[0] + curve_format.BINARY_EXTENSION
+            writers.append((binary_path, curve_format.CurveWriter(binary_path, self.options.double_precision)))
+        if self.options.nav_graph:
+            graph_path = nav_graph.nav_graph_filename(export_path)
+            writers.append((graph_path, nav_graph.NavGraphWriter(graph_path, self.options.nav_tolerance)))
+        try:
+            batch = []
+            batch_points = 0
+            recorder.phase("traversal")
+            for element, transform in self.iter_paths(objects):
+                path_data, segments = self.get_path_data(element, transform)
+                batch.append((path_data, segments))
+                batch_points += sum(len(proxy.control_points) for proxy in segments)
+                if batch_points >= BATCH_CONTROL_POINTS:
+                    self.write_batch(batch, writers)
+                    batch = []
+                    batch_points = 0
+                    recorder.phase("traversal")
+            self.write_batch(batch, writers)
+        finally:
+            recorder.phase("write")
+            for filename, writer in writers:
+                writer.close()
+                recorder.wrote(filename)
 
-                paths_data.append(data)
+    def iter_paths(self, objects):
+        """The paths in the objects and in all their groups and layers, with their composed transforms.
+        Walks the tree once, depth first in document order. The ISO sprites and the hidden elements
+        are skipped, unless they were selected themselves."""
+        layer_filter = self.options.layer
+        tags_filter = split_tags(self.options.tags_filter)
+
+        stack = []
+        for element in reversed(objects):
+            # A selected element can be inside the filtered layer already:
+            in_layer = not layer_filter or any(
+                isinstance(ancestor, inkex.Layer) and ancestor.label == layer_filter
+                for ancestor in [element] + list(element.ancestors()))
+            stack.append((element, self.transforms.composed(element.getparent()), in_layer))
+
+        selected = set(objects)
+        while stack:
+            element, parent_transform, in_layer = stack.pop()
+            if element not in selected and (self.index.is_iso(element) or is_hidden(element)):
+                continue
+            if isinstance(element, inkex.PathElement):
+                if in_layer and (not tags_filter or tags_filter & split_tags(get_tags(element))):
+                    yield element, parent_transform @ element.transform
+            elif isinstance(element, (inkex.Group, inkex.SvgDocumentElement)):
+                transform = parent_transform @ element.transform
+                if isinstance(element, inkex.Layer) and element.label == layer_filter:
+                    in_layer = True
+                for child in reversed(element):
+                    stack.append((child, transform, in_layer))
+
+    def get_path_data(self, object, transform):
+        path = object.get_path()
+        if transform:
+            path = path.transform(transform)
+
+        start_style = object.style.get("marker-start")
+        end_style = object.style.get("marker-end")
+
+        if not start_style:
+            start = ""
+        else:
+            start = "start" if "Square" in start_style else ""
+
+        if not end_style:
+            direction = "forward"
+            end = ""
+        else:
+            direction = "forward" if "Triangle" in end_style else "reverse"
+            end = "end" if "Square" in end_style else ""
 
+        data = {
+            "id" : object.get_id(),
+            "tags": get_tags(object) or None,
+            "start": start,
+            "direction": direction,
+            "end": end
+        }
+        return data, list(path.proxy_iterator())
+
+    def write_batch(self, batch, writers):
+        if not batch:
+            return
+        recorder.count("paths", len(batch))
+
+        # Collect the control points of all the segments first, so they are unprojected in one go:
+        recorder.phase("unprojection")
+        world_center_x, world_center_y = self.world_center
+        positions_x = []
+        positions_y = []
+        for path_data, segments in batch:
+            for proxy in segments:
+                for control_point in proxy.control_points:
+                    positions_x.append(control_point.x - world_center_x)
+                    positions_y.append(control_point.y - world_center_y)
+
+        iso_xs, iso_ys, iso_zs = utils.unproject_many(positions_x, positions_y, *self.iso_settings)
+        points_iso = [{"x": iso_x, "y": iso_y, "z": iso_z} for iso_x, iso_y, iso_z in zip(iso_xs, iso_ys, iso_zs)]
+
+        recorder.count("control_points", len(positions_x))
+
+        recorder.phase("curves")
         curves_iso = []
-        for i in range(len(paths)):
-            path = paths[i]
-            proxy_iterator = path.proxy_iterator()
+        first_index = 0
+        for path_data, segments in batch:
             last_control_point_iso = None
+            subpath_start_iso = None
             last_curve = None
             first_curve = True
-            for proxy in proxy_iterator:
-                control_points_iso = [utils.unproject(control_point.x - world_center_x, control_point.y - world_center_y, z_value, htw, hth, v_step) for control_point in proxy.control_points]
-                control_points_flat = [{"x": control_point.x, "y": control_point.y} for control_point in proxy.control_points]
+            for proxy in segments:
+                count = len(proxy.control_points)
+                control_points_iso = points_iso[first_index:first_index + count]
+                first_index += count
 
                 start_letter = str(proxy)[0]
                 if start_letter == "m" or start_letter == "M": # Move command
-                    last_control_point_flat = control_points_flat[0]
                     last_control_point_iso = control_points_iso[0]
+                    subpath_start_iso = last_control_point_iso
                     continue
-                elif start_letter == "l" or start_letter == "L": # Line command
+                elif start_letter in "lLhHvVzZ": # Line command, the horizontal, vertical and closing ones too
                     line_control_point_iso = control_points_iso[0]
+                    if start_letter in "zZ" and line_control_point_iso == last_control_point_iso:
+                        continue # Already closed
                     curve_iso = {
                         "cp1": last_control_point_iso,
                         "cp2": last_control_point_iso,
@@ -136,6 +236,8 @@ class ExportIsoCurves(inkex.EffectExtension):
                         "cp4": line_control_point_iso
                     }
                     last_control_point_iso = line_control_point_iso
+                    if start_letter in "zZ":
+                        last_control_point_iso = subpath_start_iso
                     # self.msg("Line command")
                 elif start_letter == "c" or start_letter == "C": # Curve command
                     cp2_iso = control_points_iso[0]
@@ -151,37 +253,88 @@ class ExportIsoCurves(inkex.EffectExtension):
 
                 elif str(proxy).startswith("s"): # This might never happen.. might. (Strung command)
                     self.msg("::: ERROR ::: Strung command")
+                    continue
                 else:
                     self.msg("::: ERROR ::: Something else happened, details:")
                     self.msg("The proxy is: " + str(proxy))
                     self.msg("DO YOU FUCKIN LISTENING?")
+                    continue
 
                 # ERROR HANDLING
                 if curve_iso["cp1"] == None:
-                    self.msg("::: ERROR ::: No first control point for curve {}".format(paths_data[i]["id"]))
+                    self.msg("::: ERROR ::: No first control point for curve {}".format(path_data["id"]))
 
                 if first_curve:
-                    if paths_data[i]["start"] == "start":
+                    if path_data["start"] == "start":
                         curve_iso["start"] = True
                 first_curve = False
-                if paths_data[i]["direction"] == "forward":
+                if path_data["direction"] == "forward":
                     curve_iso["forward"] = True
                 else:
                     curve_iso["forward"] = False
 
-                if paths_data[i]["tags"]:
-                    curve_iso["tags"] = paths_data[i]["tags"]
+                if path_data["tags"]:
+                    curve_iso["tags"] = path_data["tags"]
 
                 curves_iso.append(curve_iso)
                 last_curve = curve_iso
             
-            if paths_data[i]["end"]:
-                last_curve["end"] = paths_data[i]["end"]
+            if path_data["end"] and last_curve is not None:
+                last_curve["end"] = path_data["end"]
+
+        recorder.count("segments", len(curves_iso))
+
+        if self.options.arc_length != "off" and curves_iso:
+            self.add_arc_lengths(curves_iso)
 
         # Write the curves:
-        with open(export_path, "w") as file:
-            json.dump(curves_iso, file, indent=2)
+        recorder.phase("write")
+        for filename, writer in writers:
+            for curve_iso in curves_iso:
+                writer.write(curve_iso)
+
+    def add_arc_lengths(self, curves_iso):
+        # All the curves of the batch in one go, the runtime only has to look the tables up:
+        recorder.phase("arc_length")
+        points = []
+        for curve_iso in curves_iso:
+            for name in curve_format.CONTROL_POINTS:
+                control_point = curve_iso[name]
+                points += (control_point["x"], control_point["y"], control_point["z"])
+
+        mode = self.options.arc_length
+        if mode in ("table", "both"):
+            tables = arc_length.arc_length_tables(points, self.options.arc_length_samples)
+            for curve_iso, table in zip(curves_iso, tables):
+                curve_iso["length"] = table[-1]
+                curve_iso["arc_lengths"] = table
+        if mode in ("resample", "both"):
+            polylines = arc_length.resample_curves(points, self.options.resample_spacing)
+            for curve_iso, polyline in zip(curves_iso, polylines):
+                curve_iso["points"] = polyline
+
+
+def is_hidden(element):
+    # Hidden layers and objects, Inkscape sets display:none in the style:
+    if element.get("display") == "none":
+        return True
+    style = element.get("style")
+    return style is not None and "display" in style and element.style.get("display") == "none"
+
+
+def get_tags(element):
+    # From a label like "Road [tags=car,bus]", empty without tags:
+    label = element.get("inkscape:label")
+    if label:
+        m = re.match(r".*\[tags=(.*)\]", label)
+        if m:
+            return m.group(1)
+    return ""
+
 
+def split_tags(tags):
+    # "car, bus" has the same tags as "car,bus":
+    return set(tag.strip() for tag in tags.split(",") if tag.strip())
 
 
 
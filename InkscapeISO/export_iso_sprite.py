@@ -2,21 +2,26 @@ import sys
 import os
 
 running_in_inkscape = "Inkscape" in sys.executable
-if not running_in_inkscape:
+if not running_in_inkscape and os.name == "nt":
     sys.path.append("C:\\Program Files\\Inkscape\\share\\inkscape\\extensions")
-    os.environ["PATH"] += "C:\\Program Files\\Inkscape\\bin"
+    os.environ["PATH"] += os.pathsep + "C:\\Program Files\\Inkscape\\bin"
 
 import math
-import subprocess
-import tempfile
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser
 from typing import Any
 import inkex
 import lxml
 import utils
-
-ISO_ORIGIN_TITLE = "ISO ORIGIN"
+import spatial_index
+import depth_sort
+from instrumentation import recorder
+from iso_index import IsoIndex
+from bbox_engine import VisualBoundingBoxEngine, compare_bounding_boxes
+from sprite_cache import SpriteCache, appearance_hash
+from sprite_manifest import MANIFEST_FILENAME, write_manifest, read_sprite_descriptions
 
 class ExportIsoSprite(inkex.EffectExtension):
 
@@ -26,7 +31,24 @@ class ExportIsoSprite(inkex.EffectExtension):
         # Export settings
         pars.add_argument("--export_path", type=str, default="")
         pars.add_argument("--search_scope", type=str, default="auto")
-        pars.add_argument("--export_dpi", type=float, default=96.0)
+        pars.add_argument("--export_dpi", type=utils.float_list, default="96") # The first one is the main resolution
+        pars.add_argument("--incremental", type=inkex.Boolean, default=False)
+        pars.add_argument("--jobs", type=int, default=1)
+        pars.add_argument("--export_chunk", type=int, default=50)
+        pars.add_argument("--command_timeout", type=float, default=300.0)
+        pars.add_argument("--progress", type=inkex.Boolean, default=False) # Headless runs only, Inkscape shows stderr at the end
+        pars.add_argument("--dedupe", type=inkex.Boolean, default=False)
+        pars.add_argument("--verify_bboxes", type=inkex.Boolean, default=False)
+        pars.add_argument("--bbox_tolerance", type=float, default=0.5)
+        pars.add_argument("--sprite_output", type=str, default="files")
+        pars.add_argument("--trim", type=inkex.Boolean, default=False)
+        pars.add_argument("--quantize_colors", type=int, default=0)
+        pars.add_argument("--recompress", type=inkex.Boolean, default=False)
+        pars.add_argument("--spatial_index", type=inkex.Boolean, default=False)
+        pars.add_argument("--depth_sort", type=inkex.Boolean, default=False)
+        pars.add_argument("--atlas", type=inkex.Boolean, default=False)
+        pars.add_argument("--atlas_max_size", type=int, default=2048)
+        pars.add_argument("--atlas_padding", type=int, default=1)
 
         # World settings:
         pars.add_argument("--world_center", type=str, default="page")
@@ -37,11 +59,21 @@ class ExportIsoSprite(inkex.EffectExtension):
         pars.add_argument("--vertical_step", type=int, default=128)
         pars.add_argument("--default_z", type=float, default=0.0)
 
+        pars.add_argument("--instrumentation", type=str, default="off")
+
 
     def effect(self) -> Any:
+        recorder.start(self.options.instrumentation)
+        try:
+            return self.export_sprites()
+        finally:
+            recorder.finish(os.path.join(self.options.export_path, "iso_export_report"))
+
+
+    def export_sprites(self):
         export_path = self.options.export_path
         if not os.path.exists(export_path):
-            os.mkdir(export_path)
+            os.makedirs(export_path)
             self.debug("Creating directory: " + export_path)
 
         if self.options.search_scope == "auto":
@@ -54,6 +86,12 @@ class ExportIsoSprite(inkex.EffectExtension):
                 self.msg("Search scope is \"selection\" but nothing selected.")
                 return
 
+        # One pass over the document finds all the iso groups and their origins:
+        recorder.phase("traversal")
+        self.index = IsoIndex(self.document.getroot())
+        self.transforms = utils.TransformCache(self.svg)
+        self.transforms.fill(self.document.getroot())
+
         # Assemble all the groups, their ids :
         groups = {} # A map from group id to a group
         origins = {} # A map from group id to it's iso origin 
@@ -63,16 +101,49 @@ class ExportIsoSprite(inkex.EffectExtension):
 
         for node in nodes:
             self.visit_node(node, add_group_id)
+        recorder.count("groups", len(groups))
 
         groups_names_counts = {}
         for group in groups.values():
             group.name = self.get_group_name(groups_names_counts, group)
             group.layer_name = self.get_object_layer_name(group)
 
+        # Copies of the same group share one image, it's rendered with the first of them:
+        duplicates = {} # A map from group id to the id of the group whose image it shares
+        if self.options.dedupe:
+            recorder.phase("dedupe")
+            duplicates = self.find_duplicates(groups)
+        for group_id, group in groups.items():
+            group.image_name = groups[duplicates.get(group_id, group_id)].name
+
+        # Only the groups that changed since the last export go further:
+        cache = None
+        if self.options.incremental:
+            outputs = [self.get_image_suffix(dpi) + ".png" for dpi in self.options.export_dpi]
+            if self.options.sprite_output != "manifest":
+                outputs.append(".spr")
+            cache = SpriteCache(export_path, self.get_cache_settings(), outputs, self.transforms)
+            recorder.phase("cache")
+            dirty = set(group_id for group_id, group in groups.items() if cache.is_dirty(group))
+            # The copies go together, so the image and its anchor are redone for all of them:
+            dirty_images = set(duplicates.get(group_id, group_id) for group_id in dirty)
+            groups = {group_id: group for group_id, group in groups.items() if duplicates.get(group_id, group_id) in dirty_images}
+            recorder.count("dirty_groups", len(groups))
+            # The groups deleted from the document since, whatever the search scope:
+            present = set()
+            for node in self.document.getroot():
+                self.visit_node(node, lambda group: present.add(group.get_id()))
+            cache.forget([group_id for group_id in cache.entries if group_id not in present])
+            # Only the rendering is skipped, the files about all the sprites are still brought up to date:
+            if len(groups) == 0 and not cache.stale:
+                self.msg("Nothing changed since the last export.")
+
         # Find the origins:
+        recorder.phase("origins")
         for group_id, group in groups.items():
             origin = self.get_iso_origin(group)
             origins[group_id] = origin
+        recorder.count("origins", len(origins))
 
         # Hide all origins:
         origins_styles = {}
@@ -80,25 +151,162 @@ class ExportIsoSprite(inkex.EffectExtension):
             origins_styles[origin] = origin.attrib["style"]
             origin.attrib["style"] = "display: none"
 
-        bboxes = utils.get_bounding_boxes(self.document, list(groups.keys()))
-
-        # Write spr files:
-        for group_id, group in groups.items():
-            bbox = bboxes[group_id]
-            origin = origins[group_id]
-            self.write_spr_file(group, bbox, origin)
-
-        # Export the images of groups:
-        self.export_groups(groups)
+        # The bounding boxes are computed in-process, Inkscape is only needed for the rendering:
+        recorder.phase("bbox")
+        rendered = {group_id: group for group_id, group in groups.items() if group_id not in duplicates}
+        bboxes = VisualBoundingBoxEngine(self.svg, self.transforms).get_bounding_boxes(list(rendered.keys()))
+
+        # The document is serialized once, all the Inkscape processes load the same file:
+        sprites = {} # A map from group id to the sprite description
+        errors = {}
+        if groups: # Only deletions when nothing changed
+            recorder.phase("inkscape_start")
+            with utils.DocumentFile(self.document) as document_file, utils.InkscapeShell(document_file, timeout=self.options.command_timeout) as session:
+                if self.options.verify_bboxes:
+                    recorder.phase("bbox_verification")
+                    bboxes = self.verify_bounding_boxes(rendered, bboxes, session)
+
+                # Write spr files:
+                recorder.phase("spr_files")
+                locations = self.get_iso_locations(origins)
+                for group_id, group in groups.items():
+                    if group_id in duplicates:
+                        # The copies share the image but each has its own origin, placed by hand:
+                        shared_id = duplicates[group_id]
+                        bboxes[group_id] = self.get_duplicate_bbox(group, groups[shared_id], bboxes[shared_id])
+                    bbox = bboxes[group_id]
+                    origin = origins[group_id]
+                    sprites[group_id] = self.get_sprite(group, bbox, origin, locations[group_id])
+                    if self.options.sprite_output != "manifest":
+                        self.write_spr_file(sprites[group_id])
+
+                # Export the images of groups:
+                recorder.phase("png_export")
+                errors = self.export_groups(rendered, session, bboxes)
+                for group_id, shared_id in duplicates.items():
+                    if shared_id in errors:
+                        errors[group_id] = errors[shared_id]
 
         # Restore origins visibilities:
-        for group in groups.values():
-            group = groups[group_id]
-            origin = self.get_iso_origin(group)
-            origin.attrib["style"] = origins_styles[origin]
+        for origin, style in origins_styles.items():
+            origin.attrib["style"] = style
+
+        for group_id, error in errors.items():
+            self.msg("Failed to export group \"%s\": %s" % (groups[group_id].name, error))
+
+        exported = {group_id: sprite for group_id, sprite in sprites.items() if group_id not in errors}
+
+        # Smaller images, the anchors and sizes are moved with them so the placement stays the same:
+        if self.options.trim or self.options.quantize_colors or self.options.recompress:
+            recorder.phase("png_postprocess")
+            import png_postprocess # Needs Pillow, which the plain export doesn't
+            # The shared images before, the copies' anchors are moved the same way:
+            shared_entries = {shared_id: [dict(entry) for entry in exported[shared_id].get("resolutions", [exported[shared_id]])]
+                for shared_id in set(duplicates.values()) if shared_id in exported}
+            saved = png_postprocess.postprocess_sprites(export_path,
+                [sprite for group_id, sprite in exported.items() if group_id not in duplicates],
+                self.options.trim, self.options.quantize_colors, self.options.recompress, self.options.jobs)
+            recorder.count("png_bytes_saved", saved)
+            for group_id in exported:
+                if group_id in duplicates:
+                    shared_id = duplicates[group_id]
+                    exported[group_id] = self.get_postprocessed_duplicate(exported[group_id], shared_entries[shared_id], exported[shared_id])
+            if self.options.sprite_output != "manifest":
+                for sprite in exported.values():
+                    self.write_spr_file(sprite)
+
+        removed = set() # The names of the sprites deleted or renamed since the last export
+        if cache is not None:
+            # Failed groups stay dirty for the next run:
+            recorder.phase("cache")
+            cache.update({group_id: group for group_id, group in groups.items() if group_id not in errors})
+            removed = cache.prune()
+            recorder.count("removed_sprites", len(removed))
+
+        # All the descriptions in one file, replaced in one go so a reader never sees half of an export:
+        if self.options.sprite_output != "files":
+            recorder.phase("manifest")
+            manifest_filename = os.path.join(export_path, MANIFEST_FILENAME)
+            write_manifest(manifest_filename, exported.values(), keep_existing=cache is not None, removed=removed)
+            recorder.wrote(manifest_filename)
+
+        # Saved last, an interrupted run exports again what it didn't finish:
+        if cache is not None:
+            cache.save()
+            recorder.wrote(cache.filename)
+
+        # The files describing all the sprites of this export at once:
+        if self.options.spatial_index or self.options.depth_sort or self.options.atlas:
+            current_sprites = self.get_current_sprites(exported, cache)
+
+        # The culling structure for the runtime:
+        if self.options.spatial_index:
+            recorder.phase("spatial_index")
+            index_filename = spatial_index.write_sprites_index(export_path, current_sprites,
+                self.options.tile_width / 2, self.options.tile_height / 2, self.options.vertical_step, self.options.export_dpi[0])
+            recorder.wrote(index_filename)
+
+        # The back to front order of the static sprites, so the runtime doesn't sort them every frame:
+        if self.options.depth_sort:
+            recorder.phase("depth_sort")
+            order_filename = depth_sort.write_draw_order(export_path, current_sprites,
+                self.options.tile_width / 2, self.options.tile_height / 2, self.options.vertical_step, self.options.export_dpi[0])
+            recorder.wrote(order_filename)
+
+        # Pack the sprites of this export, including the ones skipped by the incremental export:
+        if self.options.atlas:
+            recorder.phase("atlas")
+            import atlas # Needs Pillow too
+            manifest = atlas.build_atlas(export_path, current_sprites,
+                self.options.atlas_max_size, self.options.atlas_padding)
+            for sheet in manifest["sheets"]:
+                recorder.wrote(os.path.join(export_path, sheet["image"]))
+            recorder.wrote(os.path.join(export_path, "atlas.json"))
+            self.msg("Packed %d sprites into %d atlas sheets." % (len(manifest["sprites"]), len(manifest["sheets"])))
         return
 
 
+    def get_current_sprites(self, exported, cache):
+        # The sprites just exported and, incremental, the unchanged ones the cache still knows.
+        # Not every .spr in the directory, the files of other documents or older exports don't belong to it:
+        sprites = {sprite["name"]: sprite for sprite in exported.values()}
+        if cache is not None:
+            unchanged = set(entry["name"] for entry in cache.entries.values()).difference(sprites)
+            for sprite in read_sprite_descriptions(self.options.export_path, self.options.sprite_output != "files", unchanged):
+                sprites[sprite["name"]] = sprite
+        return sorted(sprites.values(), key=lambda sprite: sprite["name"])
+
+
+    def verify_bounding_boxes(self, groups, bboxes, session):
+        # Compare with what Inkscape reports and trust Inkscape from now on:
+        inkscape_bboxes = utils.get_bounding_boxes(session, list(groups.keys()))
+        mismatched = compare_bounding_boxes(inkscape_bboxes, bboxes, self.options.bbox_tolerance)
+        for group_id in mismatched:
+            self.msg("Bounding box of \"%s\" differs from Inkscape: %s != %s" % (
+                groups[group_id].name, bboxes[group_id], inkscape_bboxes[group_id]))
+        return inkscape_bboxes
+
+
+    def get_cache_settings(self):
+        # Everything besides the group itself that changes the exported files:
+        # Not svg.defs, it would add an empty <defs> to a document without one:
+        defs = self.svg.find(inkex.addNS("defs", "svg"))
+        return {
+            "export_dpi": self.options.export_dpi,
+            "world_center": self.options.world_center,
+            "custom_center_x": self.options.custom_center_x,
+            "custom_center_y": self.options.custom_center_y,
+            "tile_width": self.options.tile_width,
+            "tile_height": self.options.tile_height,
+            "vertical_step": self.options.vertical_step,
+            "default_z": self.options.default_z,
+            "sprite_output": self.options.sprite_output,
+            "dedupe": self.options.dedupe,
+            "png_postprocess": [self.options.trim, self.options.quantize_colors, self.options.recompress],
+            "page_size": [self.svg.get("width"), self.svg.get("height")],
+            "defs": lxml.etree.tostring(defs).decode("utf-8") if defs is not None else "",
+        }
+
 
     def visit_node(self, node, visitor_func):
         if isinstance(node, inkex.Group):
@@ -113,6 +321,19 @@ class ExportIsoSprite(inkex.EffectExtension):
             return
 
 
+    def find_duplicates(self, groups):
+        # Returns a map from group id to the id of the first group that looks the same:
+        first_ids = {} # A map from appearance hash to the first group id
+        digests = {} # The definitions' digests, the copies often reference the same ones
+        duplicates = {}
+        for group_id, group in groups.items():
+            first_id = first_ids.setdefault(appearance_hash(group, self.transforms.composed(group), digests), group_id)
+            if first_id != group_id:
+                duplicates[group_id] = first_id
+        recorder.count("duplicate_groups", len(duplicates))
+        return duplicates
+
+
     def get_group_name(self, groups_names_counts, group):
         group_name = group.get("inkscape:label") or group.get_id()
         number_suffix = ""
@@ -126,12 +347,10 @@ class ExportIsoSprite(inkex.EffectExtension):
     
 
     def get_object_layer_name(self, object):
-        ancestors = object.ancestors()
-        layer = ancestors[len(ancestors) - 2]
-        return layer.get("inkscape:label")
+        return self.index.layer_names[object]
 
 
-    def write_spr_file(self, group, bbox, origin):
+    def get_iso_locations(self, origins):
         # Set up the variables:
         htw = self.options.tile_width / 2
         hth = self.options.tile_height / 2
@@ -146,38 +365,25 @@ class ExportIsoSprite(inkex.EffectExtension):
             world_center_x = self.options.custom_center_x
             world_center_y = self.options.custom_center_y
 
-        # WolframAlpha solution path:
-        # solve a = x * p - y * p , b = x * q + y * q  - z * r for x
-        # => y = x - a/p
-        # => solve  b = x * q + (x - a/p) * q - z * r for x
-        # => x = (a*q + b*p + p*r*z) / (2 * p * q)
-        # => y = x - a/p
-        # Where:
-        # a - the x coordinate of the origin on the canvas
-        # b - the y coordinate of the origin on the canvas
-        # x - the iso_x
-        # y - the iso_y
-        # z - the iso_z (default_z)
-        # p - half tile width
-        # q - half tile height
-        # r - vertical step
-
-        position_x = origin.x - world_center_x
-        position_y = origin.y - world_center_y
+        # See utils.unproject for the math, all the origins are unprojected in one go:
+        groups_ids = list(origins.keys())
+        positions_x = [origins[group_id].x - world_center_x for group_id in groups_ids]
+        positions_y = [origins[group_id].y - world_center_y for group_id in groups_ids]
 
         # Z component
-        iso_z = None
-        origin_data = origin.get("inkscape:label") or origin.get_id()
-        z_start = origin_data.find("Z=")
-        if z_start != -1:
-            z_end = len(origin_data) - 1
-            iso_z = float(origin_data[z_start + 2: z_end])
-        iso_z = iso_z or self.options.default_z
+        iso_zs = []
+        for group_id in groups_ids:
+            iso_z = self.index.z_values[origins[group_id]]
+            iso_zs.append(iso_z or self.options.default_z)
 
-        # Find the location of the iso sprite:
-        location = utils.unproject(position_x, position_y, iso_z, htw, hth, v_step)
+        iso_xs, iso_ys, iso_zs = utils.unproject_many(positions_x, positions_y, iso_zs, htw, hth, v_step)
+        locations = {}
+        for group_id, iso_x, iso_y, iso_z in zip(groups_ids, iso_xs, iso_ys, iso_zs):
+            locations[group_id] = {"x": iso_x, "y": iso_y, "z": iso_z}
+        return locations
 
 
+    def get_sprite(self, group, bbox, origin, location):
         def clamp(value, min, max):
             if value < min: return min
             if value > max: return max
@@ -191,72 +397,156 @@ class ExportIsoSprite(inkex.EffectExtension):
         anchor_y = (origin.y - y) / bbox.height
         anchor = {"anchorX": anchor_x, "anchorY": anchor_y}
 
-        size = {
-            "width": math.ceil((self.options.export_dpi / 96.0) * bbox.width),
-            "height": math.ceil((self.options.export_dpi / 96.0) * bbox.height),
+        # Every resolution is the same bounding box at another scale:
+        resolutions = []
+        for dpi in self.options.export_dpi:
+            resolutions.append({
+                "dpi": dpi,
+                "image": group.image_name + self.get_image_suffix(dpi) + ".png",
+                "anchor": anchor,
+                "size": {
+                    "width": math.ceil((dpi / 96.0) * bbox.width),
+                    "height": math.ceil((dpi / 96.0) * bbox.height),
+                },
+            })
+
+        sprite = {
+            "name": group.name,
+            "layer_name": group.layer_name,
+            "image": resolutions[0]["image"],
+            "location": location,
+            "anchor": anchor,
+            "size": resolutions[0]["size"]
         }
+        if len(resolutions) > 1:
+            sprite["resolutions"] = resolutions
+        return sprite
+
+    def get_duplicate_bbox(self, group, shared_group, shared_bbox):
+        # The contents of the copies only differ by the translation of their composed transforms:
+        transform = self.transforms.composed(group)
+        shared_transform = self.transforms.composed(shared_group)
+        return utils.BoundingBox(
+            shared_bbox.x + self.transforms.to_pixels(transform.e - shared_transform.e),
+            shared_bbox.y + self.transforms.to_pixels(transform.f - shared_transform.f),
+            shared_bbox.width,
+            shared_bbox.height,
+        )
 
-      
+    def get_postprocessed_duplicate(self, sprite, shared_entries, shared_sprite):
+        # The shared image was trimmed, the copy's anchors stay as many pixels away from the shared ones:
+        def move(entry, before, after):
+            return dict(entry, image=after["image"], size=after["size"], anchor={
+                "anchorX": after["anchor"]["anchorX"] + (entry["anchor"]["anchorX"] - before["anchor"]["anchorX"]) * before["size"]["width"] / after["size"]["width"],
+                "anchorY": after["anchor"]["anchorY"] + (entry["anchor"]["anchorY"] - before["anchor"]["anchorY"]) * before["size"]["height"] / after["size"]["height"],
+            })
+
+        if "resolutions" not in sprite:
+            return move(sprite, shared_entries[0], shared_sprite)
+        resolutions = [move(*entries) for entries in zip(sprite["resolutions"], shared_entries, shared_sprite["resolutions"])]
+        return dict(sprite, resolutions=resolutions, anchor=resolutions[0]["anchor"], size=resolutions[0]["size"])
+
+    def get_image_suffix(self, dpi):
+        # The main resolution keeps the plain name, the others are name@2x.png, name@0.5x.png...
+        if dpi == self.options.export_dpi[0]:
+            return ""
+        return "@%gx" % (dpi / 96.0)
+
+    def write_spr_file(self, sprite):
         # Write the sprite description (.spr) file:
-        declaration_filename = self.options.export_path + os.sep + group.name + ".spr"
+        declaration_filename = self.options.export_path + os.sep + sprite["name"] + ".spr"
         with open(declaration_filename, "w") as f:
-            sprite = {
-                "name": group.name,
-                "layer_name": group.layer_name,
-                "image": group.name + ".png",
-                "location": location,
-                "anchor": anchor,
-                "size": size
-            }
             json.dump(sprite, f, indent = 2)
-        
-
-
-    def export_groups(self, groups):
+        recorder.wrote(declaration_filename)
+
+
+    def export_groups(self, groups, session, bboxes):
+        # Returns a map from group id to the error, for the groups that failed to export.
+        progress = utils.Progress(len(groups) * len(self.options.export_dpi), "Exported images", self.options.progress)
+        # A second of slack for coarse file system clocks, Inkscape alone takes longer than that to start:
+        self.export_start = time.time() - 1.0
+        jobs = max(1, min(self.options.jobs, len(groups)))
+        if jobs == 1:
+            return self.export_shard(session, groups, list(groups.keys()), progress)
+
+        # Balance the shards by the area to render:
+        areas = {group_id: bboxes[group_id].width * bboxes[group_id].height for group_id in groups}
+        shards = utils.balanced_shards(areas, jobs)
+
+        def export_shard_in_worker(shard):
+            with utils.InkscapeShell(session.document_file, timeout=session.timeout) as worker_session:
+                return self.export_shard(worker_session, groups, shard, progress)
+
+        errors = {}
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            # The already running session takes the first shard:
+            futures = {executor.submit(export_shard_in_worker, shard): shard for shard in shards[1:]}
+            errors.update(self.export_shard(session, groups, shards[0], progress))
+            for future, shard in futures.items():
+                try:
+                    errors.update(future.result())
+                except Exception as error: # The worker didn't even start
+                    errors.update({group_id: error for group_id in shard})
+        return errors
+
+    def export_shard(self, session, groups, groups_ids, progress):
         export_directory = self.options.export_path
-
-        groups_ids = []
-        for group in groups.values():
-            groups_ids.append(group.get_id())
-
-        actions = []
-        for group in groups.values():
-            actions.append("export-id:%s" % group.get_id())
-            actions.append("export-id-only")    
-            actions.append("export-filename:%s" % (export_directory + os.sep + group.name + ".png"))
-            actions.append("export-do")
-
-        utils.inkscape(self.document, "--actions=\"%s\"" % "; ".join(actions)  + " --export-dpi={}".format(self.options.export_dpi), use_cmd=True)          
-
-        # TODO: Display the export report:
-        # self.msg("Exported group with id:\"%s\" and name: \"%s\"" % (group.get_id(), group_name))
-        # self.msg("Saved filename: \"" + filename_name + ".png\"")
+        # All the resolutions are rendered from the same loaded document:
+        exports = [] # (group id, filename, dpi)
+        for group_id in groups_ids:
+            for dpi in self.options.export_dpi:
+                filename = export_directory + os.sep + groups[group_id].name + self.get_image_suffix(dpi) + ".png"
+                exports.append((group_id, filename, dpi))
+
+        # Several groups go on one shell line, the chunks keep the lines short and a failure contained:
+        errors = {}
+        for chunk in utils.chunks(exports, max(1, self.options.export_chunk)):
+            try:
+                session.export_objects(chunk)
+                recorder.count("export_chunks")
+                # A live shell doesn't report a failed export (an unknown id...), the file just isn't there:
+                failed = [export for export in chunk if not written_since(export[1], self.export_start)]
+            except inkex.command.ProgramRunError:
+                failed = chunk
+            if failed:
+                # Retry export by export, on a fresh process if it died, so only the broken groups fail:
+                recorder.count("export_chunk_retries")
+                errors.update(self.export_one_by_one(session, failed))
+            for group_id, filename, dpi in chunk:
+                if group_id not in errors:
+                    recorder.wrote(filename)
+            progress.advance(len(chunk))
+        return errors
+
+    def export_one_by_one(self, session, exports):
+        errors = {}
+        for group_id, filename, dpi in exports:
+            try:
+                if session.process is None or session.process.poll() is not None:
+                    session.restart()
+                session.export_object(group_id, filename, dpi)
+            except inkex.command.ProgramRunError as error:
+                errors[group_id] = error
+                continue
+            if not written_since(filename, self.export_start):
+                errors[group_id] = RuntimeError("Inkscape didn't write %s" % filename)
+        return errors
 
 
     def group_is_iso(self, group):
-        for child in group.iterchildren():
-            id = child.get_id()
-            if f"[{ISO_ORIGIN_TITLE}]" in id:
-                return True
-        return False
+        return self.index.is_iso(group)
 
     def get_iso_origin(self, iso_group):
-        origin = None
-        for child in iso_group.iterchildren():
-            id = child.get_id()
-            if f"[{ISO_ORIGIN_TITLE}]" in id:
-                origin = child
-                break
-        
+        origin = self.index.origins.get(iso_group)
         if origin is None:
             return None
 
         # Calculate the origin absolute position:
-        group_transform = iso_group.composed_transform()
+        group_transform = self.transforms.composed(iso_group)
         origin_bbox = origin.bounding_box(group_transform)
         origin_bbox_center_pixels = (
-            self.svg.uutounit(origin_bbox.center_x),
-            self.svg.uutounit(origin_bbox.center_y)
+            self.transforms.to_pixels(origin_bbox.center_x),
+            self.transforms.to_pixels(origin_bbox.center_y)
         )
         origin_x = origin_bbox_center_pixels[0]
         origin_y = origin_bbox_center_pixels[1]
@@ -266,6 +556,12 @@ class ExportIsoSprite(inkex.EffectExtension):
         return origin
 
 
+def written_since(filename, start):
+    try:
+        return os.path.getmtime(filename) >= start
+    except OSError:
+        return False
+
 
 if __name__ == '__main__':
     extension = ExportIsoSprite()
@@ -0,0 +1,88 @@
+import os
+import json
+import time
+import cProfile
+import threading
+
+REPORT_VERSION = 1
+
+
+class Instrumentation:
+    """Opt-in wall-clock phases and counters of an extension run, written as a JSON report"""
+
+    def __init__(self):
+        self.lock = threading.Lock() # Counters are also updated from the export worker threads
+        self.reset("off")
+
+    def reset(self, mode):
+        self.mode = mode
+        self.enabled = mode != "off"
+        self.phases = {} # A map from phase name to seconds
+        self.counters = {}
+        self.current_phase = None
+        self.phase_start = None
+        self.run_start = time.perf_counter()
+        self.profiler = None
+
+    def start(self, mode):
+        self.reset(mode)
+        if mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def phase(self, name):
+        # Ends the running phase and starts the next one:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self.current_phase is not None:
+            self.phases[self.current_phase] = self.phases.get(self.current_phase, 0.0) + now - self.phase_start
+        self.current_phase = name
+        self.phase_start = now
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def subprocess(self, seconds, started=False):
+        # Time spent waiting for Inkscape, started is set when a new process was spawned:
+        if not self.enabled:
+            return
+        with self.lock:
+            if started:
+                self.counters["subprocess_count"] = self.counters.get("subprocess_count", 0) + 1
+            self.counters["subprocess_seconds"] = self.counters.get("subprocess_seconds", 0.0) + seconds
+
+    def wrote(self, filename):
+        if not self.enabled or not os.path.exists(filename):
+            return
+        self.count("bytes_written", os.path.getsize(filename))
+        self.count("files_written")
+
+    def finish(self, report_basename):
+        """Writes <report_basename>.json (and .prof with cProfile) and disables the recording"""
+        if not self.enabled:
+            return
+        self.phase(None)
+        if self.profiler is not None:
+            self.profiler.disable()
+
+        directory = os.path.dirname(report_basename)
+        if not directory or os.path.isdir(directory):
+            if self.profiler is not None:
+                self.profiler.dump_stats(report_basename + ".prof")
+            report = {
+                "version": REPORT_VERSION,
+                "total_seconds": time.perf_counter() - self.run_start,
+                "phases": self.phases,
+                "counters": self.counters,
+            }
+            with open(report_basename + ".json", "w") as f:
+                json.dump(report, f, indent=2)
+        self.reset("off")
+
+
+# Shared by the extensions and utils, one extension runs per process:
+recorder = Instrumentation()
@@ -0,0 +1,138 @@
+import os
+import sys
+import io
+import glob
+import json
+import time
+import importlib
+import contextlib
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+# The extensions by command name, as (module, class) so the workers import them lazily:
+EXTENSIONS = {
+    "sprites": ("export_iso_sprite", "ExportIsoSprite"),
+    "curves": ("export_iso_curves", "ExportIsoCurves"),
+    "mark": ("mark_iso_sprite", "MarkIsoSprite"),
+}
+
+
+def expand_documents(patterns):
+    documents = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for document in matches:
+            if document not in documents:
+                documents.append(document)
+    return documents
+
+
+def document_arguments(arguments, document):
+    # {name} and {dir} in the extension arguments are replaced per document:
+    name = os.path.splitext(os.path.basename(document))[0]
+    directory = os.path.dirname(os.path.abspath(document))
+    return [argument.replace("{name}", name).replace("{dir}", directory) for argument in arguments]
+
+
+def use_document(extension, svg_document):
+    # Instead of InkscapeExtension.load(), the document is neither parsed again nor copied.
+    # Only for the exports, they leave the document as they found it:
+    def load(stream):
+        extension.original_document = svg_document
+        extension.svg = svg_document.getroot()
+        extension.svg.selection.set(*extension.options.ids)
+        return svg_document
+    extension.load = load
+
+
+def run_extension(command, document, arguments, output, svg_document=None):
+    """Runs one extension on one document, returns the summary of the run.
+    The svg_document is the document already loaded by the caller, if any."""
+    module_name, class_name = EXTENSIONS[command]
+    extension_class = getattr(importlib.import_module(module_name), class_name)
+
+    summary = {"document": document, "command": command, "status": "ok"}
+    messages = io.StringIO()
+    start = time.perf_counter()
+    try:
+        os.environ["DOCUMENT_PATH"] = document
+        with contextlib.redirect_stderr(messages):
+            extension = extension_class()
+            if svg_document is not None:
+                use_document(extension, svg_document)
+            if output is None: # Only the exported files matter, not the document
+                extension.run([document] + arguments, output=io.BytesIO())
+            else:
+                extension.run([document, "--output=" + output] + arguments)
+    except SystemExit as error: # inkex exits on AbortExtension
+        if error.code:
+            summary["status"] = "failed"
+    except Exception as error:
+        summary["status"] = "failed"
+        summary["error"] = "%s: %s" % (type(error).__name__, error)
+    summary["seconds"] = time.perf_counter() - start
+    summary["messages"] = [line for line in messages.getvalue().splitlines() if line.strip()]
+    return summary
+
+
+def run_batch(command, documents, arguments, jobs=1, output=None):
+    tasks = []
+    for document in documents:
+        document_output = document_arguments([output], document)[0] if output else None
+        tasks.append((command, document, document_arguments(arguments, document), document_output))
+
+    if jobs <= 1 or len(tasks) <= 1:
+        return [run_extension(*task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_extension, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def write_summary(summary):
+    sys.stdout.write("%-7s %8.2fs  %s\n" % (summary["status"], summary["seconds"], summary["document"]))
+    if "error" in summary:
+        sys.stdout.write("        %s\n" % summary["error"])
+    for message in summary["messages"]:
+        sys.stdout.write("        %s\n" % message)
+
+
+def main(args=None):
+    parser = ArgumentParser(
+        description="Run the ISO extensions headless over many documents.",
+        epilog="Arguments after -- go to the extension, {name} and {dir} are replaced with the "
+            "document's name and directory, e.g. -- --export_path=exports/{name}",
+    )
+    parser.add_argument("command", choices=sorted(EXTENSIONS.keys()))
+    parser.add_argument("documents", nargs="+", help="SVG files or glob patterns")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Documents processed in parallel")
+    parser.add_argument("--output", default=None, help="Where to save the changed documents (for mark), e.g. {dir}/{name}.svg")
+    parser.add_argument("--summary", default=None, help="Also write the per-document summary as JSON")
+
+    args = sys.argv[1:] if args is None else args
+    if "--" in args:
+        split = args.index("--")
+        args, extension_arguments = args[:split], args[split + 1:]
+    else:
+        extension_arguments = []
+    options = parser.parse_args(args)
+
+    if options.command == "mark" and options.output is None:
+        parser.error("mark changes the documents, --output is required")
+
+    documents = expand_documents(options.documents)
+    summaries = run_batch(options.command, documents, extension_arguments, options.jobs, options.output)
+
+    for summary in summaries:
+        write_summary(summary)
+
+    if options.summary:
+        with open(options.summary, "w") as f:
+            json.dump(summaries, f, indent=2)
+
+    failed = sum(1 for summary in summaries if summary["status"] != "ok")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import re
+
+ISO_ORIGIN_TITLE = "ISO ORIGIN"
+ISO_ORIGIN_TAG = f"[{ISO_ORIGIN_TITLE}]"
+
+Z_REGEX = re.compile(r"\[Z=([^\]]*)\]")
+NUMBER_REGEX = re.compile(r"\[#(\d+)\]")
+
+
+def is_iso_origin(element):
+    for name in (element.get("id"), element.get("inkscape:label")):
+        if name is not None and ISO_ORIGIN_TAG in name:
+            return True
+    return False
+
+
+def parse_origin_number(origin):
+    numbers = [int(match) for name in (origin.get("id"), origin.get("inkscape:label")) if name for match in NUMBER_REGEX.findall(name)]
+    return max(numbers) if numbers else None
+
+
+def parse_origin_z(origin):
+    origin_data = origin.get("inkscape:label") or origin.get("id") or ""
+    match = Z_REGEX.search(origin_data)
+    if match is None:
+        return None
+    try:
+        return float(match.group(1))
+    except ValueError:
+        return None
+
+
+class IsoIndex:
+    """ISO groups, their origins and layers, collected in a single pass over the document"""
+
+    def __init__(self, root):
+        self.root = root
+        self.origins = {} # A map from iso group to its (first) origin
+        self.z_values = {} # A map from origin to its Z value, None if it has none
+        self.layer_names = {} # A map from iso group to the label of its layer
+        self.origin_count = 0 # Number of origins
+        self.last_number = -1 # The highest [#number] of the origins, new origins get the next one
+        self.build()
+
+    def build(self):
+        root_label = self.root.get("inkscape:label")
+        for layer in self.root.iterchildren():
+            layer_label = layer.get("inkscape:label")
+            for element in layer.iter():
+                if not isinstance(element.tag, str) or not is_iso_origin(element):
+                    continue
+                group = element.getparent()
+                self.add_origin(group, element, layer_label if group is not layer else root_label)
+
+    def is_iso(self, group):
+        return group in self.origins
+
+    def next_number(self):
+        # Past every number in use, the count alone collides after origins were removed:
+        return max(self.origin_count, self.last_number + 1)
+
+    def add_origin(self, group, origin, layer_name=None):
+        if is_iso_origin(origin):
+            self.origin_count += 1
+            number = parse_origin_number(origin)
+            if number is not None:
+                self.last_number = max(self.last_number, number)
+        self.z_values[origin] = parse_origin_z(origin)
+        if group in self.origins:
+            return
+        self.origins[group] = origin
+        self.layer_names[group] = layer_name
+
+    def remove_origins(self, group):
+        # Removes the origins of the group from the document and the index:
+        for child in list(group.iterchildren()):
+            # The tag can be in the id or the label, same as the origins build() finds:
+            if not isinstance(child.tag, str) or not is_iso_origin(child):
+                continue
+            group.remove(child)
+            self.origin_count -= 1
+            self.z_values.pop(child, None)
+            if self.origins.get(group) is child:
+                del self.origins[group]
@@ -0,0 +1,58 @@
+# The iso <-> canvas math, without any dependency so the standalone tools can import it.
+
+try:
+    import numpy
+except ImportError: # Only a speed-up, the pure python path gives the same results
+    numpy = None
+
+
+def unproject(position_x, position_y, iso_z, htw, hth, v_step):
+     # WolframAlpha solution path:
+        # solve a = x * p - y * p , b = x * q + y * q  - z * r for x
+        # => y = x - a/p
+        # => solve  b = x * q + (x - a/p) * q - z * r for x
+        # => x = (a*q + b*p + p*r*z) / (2 * p * q)
+        # => y = x - a/p
+        # Where:
+        # a - the x coordinate of the origin on the canvas
+        # b - the y coordinate of the origin on the canvas
+        # x - the iso_x
+        # y - the iso_y
+        # z - the iso_z (default_z)
+        # p - half tile width
+        # q - half tile height
+        # r - vertical step
+
+        # Find the location of the document space 2d point (position_x, position_y):
+        # Z component
+        # X and Y components - see above for the solution.
+        iso_x = (position_x * hth + position_y * htw + hth * v_step * iso_z) / (2 * htw * hth)
+        iso_y = iso_x - position_x / htw
+        location = {"x": iso_x, "y": iso_y, "z": iso_z}
+        return location
+
+
+def project(iso_x, iso_y, iso_z, htw, hth, v_step):
+    # The inverse of unproject(), the canvas position relative to the world center:
+    position_x = (iso_x - iso_y) * htw
+    position_y = (iso_x + iso_y) * hth - iso_z * v_step * hth / htw
+    return position_x, position_y
+
+
+def unproject_many(positions_x, positions_y, iso_z, htw, hth, v_step):
+    """Batched unproject(): returns the lists of iso x, y and z for the canvas positions.
+    The iso_z can be a single value or one value per position."""
+    count = len(positions_x)
+    if numpy is not None:
+        xs = numpy.asarray(positions_x, dtype=numpy.float64)
+        ys = numpy.asarray(positions_y, dtype=numpy.float64)
+        zs = numpy.broadcast_to(numpy.asarray(iso_z, dtype=numpy.float64), (count,))
+        iso_xs = (xs * hth + ys * htw + hth * v_step * zs) / (2 * htw * hth)
+        iso_ys = iso_xs - xs / htw
+        return iso_xs.tolist(), iso_ys.tolist(), zs.tolist()
+
+    zs = list(iso_z) if hasattr(iso_z, "__len__") else [iso_z] * count
+    denominator = 2 * htw * hth
+    iso_xs = [(x * hth + y * htw + hth * v_step * z) / denominator for x, y, z in zip(positions_x, positions_y, zs)]
+    iso_ys = [iso_x - x / htw for iso_x, x in zip(iso_xs, positions_x)]
+    return iso_xs, iso_ys, zs
@@ -0,0 +1,121 @@
+import os
+import sys
+import time
+import shlex
+import hashlib
+from argparse import ArgumentParser
+
+import inkex
+from lxml import etree
+from iso_batch import run_extension, write_summary
+
+
+def file_signature(filename):
+    # None while the file is missing, editors often save through a rename:
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def digest(*parts):
+    hasher = hashlib.sha1()
+    for part in parts:
+        hasher.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def curves_digest(svg, curves_layer):
+    # The whole layers, the curves are exported with the transforms of their groups. The page and defs too:
+    defs = svg.find(inkex.addNS("defs", "svg"))
+    parts = [svg.get("width"), svg.get("height"), etree.tostring(defs) if defs is not None else b""]
+    for layer in svg.iter():
+        if isinstance(layer, inkex.Layer) and layer.get("inkscape:label") == curves_layer:
+            parts.append(etree.tostring(layer))
+    return digest(*parts)
+
+
+class Watcher:
+    """Polls the document and re-runs the exports of what changed since the last save.
+    Each save is parsed once, the exports work on that same document in this process."""
+
+    def __init__(self, document, sprites_arguments=None, curves_arguments=None, curves_layer=None):
+        self.document = document
+        self.sprites_arguments = sprites_arguments
+        self.curves_arguments = curves_arguments
+        self.curves_layer = curves_layer
+        self.curves = None # The digest of the curves layers at the last export
+
+    def sync(self):
+        try:
+            svg_document = inkex.load_svg(self.document)
+        except Exception as error: # Half written or broken, the next save fixes it
+            sys.stdout.write("Can't read %s: %s\n" % (self.document, error))
+            return
+
+        if self.sprites_arguments is not None:
+            # The export's own cache finds the groups that changed, and keeps the names stable:
+            arguments = self.sprites_arguments + ["--incremental=true"]
+            write_summary(run_extension("sprites", self.document, arguments, None, svg_document))
+
+        if self.curves_arguments is not None:
+            curves = curves_digest(svg_document.getroot(), self.curves_layer)
+            if curves != self.curves:
+                sys.stdout.write("Curves changed\n")
+                arguments = self.curves_arguments + ["--search_scope=everything", "--layer=" + self.curves_layer]
+                write_summary(run_extension("curves", self.document, arguments, None, svg_document))
+                self.curves = curves
+        sys.stdout.flush()
+
+    def watch(self, interval=1.0, debounce=0.5):
+        self.sync()
+        last = file_signature(self.document)
+        while True:
+            time.sleep(interval)
+            signature = file_signature(self.document)
+            if signature == last:
+                continue
+            # Wait until the saving is over, the file has to stay the same for the whole debounce:
+            while True:
+                time.sleep(debounce)
+                settled = file_signature(self.document)
+                if settled == signature:
+                    break
+                signature = settled
+            last = signature
+            if signature is not None:
+                self.sync()
+
+
+def main(args=None):
+    parser = ArgumentParser(
+        description="Watch a document and re-export the ISO groups and curves that change on every save.",
+        epilog="The arguments of the exports go after an = sign, e.g. iso_watch.py world.svg "
+            "--sprites=\"--export_path=exports\" --curves=\"--export_path=exports/curves.json\" --curves_layer Curves",
+    )
+    parser.add_argument("document")
+    parser.add_argument("--sprites", default=None, help="Arguments of the sprite export, omit to not export sprites")
+    parser.add_argument("--curves", default=None, help="Arguments of the curves export, omit to not export curves")
+    parser.add_argument("--curves_layer", default=None, help="The label of the layer holding the curves")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between the checks of the file")
+    parser.add_argument("--debounce", type=float, default=0.5, help="Seconds the file has to stay unchanged before exporting")
+    options = parser.parse_args(args)
+
+    if options.curves is not None and options.curves_layer is None:
+        parser.error("--curves needs the --curves_layer to export")
+    sprites_arguments = shlex.split(options.sprites) if options.sprites is not None else None
+    curves_arguments = shlex.split(options.curves) if options.curves is not None else None
+
+    watcher = Watcher(options.document, sprites_arguments, curves_arguments, options.curves_layer)
+    sys.stdout.write("Watching %s, Ctrl+C to stop\n" % options.document)
+    sys.stdout.flush()
+    try:
+        watcher.watch(options.interval, options.debounce)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import sys
+import mmap
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The little-endian NumPy types of the array module type codes used by the binary files:
+NUMPY_TYPES = {"B": "u1", "i": "<i4", "I": "<u4", "f": "<f4", "d": "<f8"}
+
+
+def align(file):
+    # The sections are 8-byte aligned so they can be mapped straight into arrays:
+    padding = -file.tell() % 8
+    file.write(b"\0" * padding)
+    return file.tell()
+
+
+def write_array(file, values):
+    # An array.array, written little-endian whatever the machine:
+    if sys.byteorder != "little":
+        values = type(values)(values.typecode, values)
+        values.byteswap()
+    file.write(values.tobytes())
+
+
+def write_strings(file, strings):
+    # Each one an uint32 byte length followed by the utf-8 bytes:
+    for string in strings:
+        encoded = string.encode("utf-8")
+        file.write(struct.pack("<I", len(encoded)))
+        file.write(encoded)
+
+
+class MappedFile:
+    """A read-only memory mapping of a binary file, its sections are read as arrays viewing the mapping.
+    The subclasses list the attributes holding those arrays in ARRAYS, close() drops them first."""
+
+    ARRAYS = ()
+
+    def __init__(self, filename):
+        with open(filename, "rb") as file:
+            self.mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        # The arrays are views of the mapping, they have to go first:
+        for name in self.ARRAYS:
+            setattr(self, name, None)
+        self.mapping.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def array(self, offset, count, type_code):
+        """A NumPy array of the count values at offset, or a memoryview cast to them without NumPy"""
+        section = memoryview(self.mapping)[offset:offset + count * struct.calcsize(type_code)]
+        if numpy is not None:
+            return numpy.frombuffer(section, dtype=NUMPY_TYPES[type_code])
+        # Native byte order, which is little-endian on everything we ship to:
+        return section.cast(type_code)
+
+    def strings(self, offset, count):
+        """The count strings written by write_strings() at offset"""
+        strings = []
+        for i in range(count):
+            (length,) = struct.unpack_from("<I", self.mapping, offset)
+            offset += 4
+            strings.append(bytes(self.mapping[offset:offset + length]).decode("utf-8"))
+            offset += length
+        return strings
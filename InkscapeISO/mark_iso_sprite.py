@@ -2,16 +2,17 @@ import sys
 import os
 
 running_in_inkscape = "Inkscape" in sys.executable
-if not running_in_inkscape:
+if not running_in_inkscape and os.name == "nt":
     sys.path.append("C:\\Program Files\\Inkscape\\share\\inkscape\\extensions")
-    os.environ["PATH"] += "C:\\Program Files\\Inkscape\\bin"
+    os.environ["PATH"] += os.pathsep + "C:\\Program Files\\Inkscape\\bin"
 
+import re
 from argparse import ArgumentParser
 from typing import Any
 import inkex
 import utils
-
-ISO_ORIGIN_TITLE = "ISO ORIGIN"
+from instrumentation import recorder
+from iso_index import IsoIndex, ISO_ORIGIN_TITLE
 
 class MarkIsoSprite(inkex.EffectExtension):
 
@@ -20,11 +21,25 @@ class MarkIsoSprite(inkex.EffectExtension):
         pars.add_argument("--show_origin", type=bool, default=True)
         pars.add_argument("--z_value", type=float, default=0.0)
 
+        # Batch marking:
+        pars.add_argument("--mark_mode", type=str, default="selection")
+        pars.add_argument("--label_pattern", type=str, default="")
+        pars.add_argument("--layer", type=str, default="")
+        pars.add_argument("--skip_marked", type=inkex.Boolean, default=False)
+        pars.add_argument("--instrumentation", type=str, default="off")
+
     def effect(self) -> Any:
-        if not running_in_inkscape:
-            floor2 = self.svg.getElementById("g2511")
-            window_w = self.svg.getElementById("g60")
-            self.svg.selection.set(window_w)
+        recorder.start(self.options.instrumentation)
+        try:
+            return self.mark_sprites()
+        finally:
+            # There's no export directory, the report goes next to the document:
+            document_path = os.environ.get("DOCUMENT_PATH") or self.options.input_file
+            recorder.finish(os.path.splitext(str(document_path))[0] + "_mark_report")
+
+    def mark_sprites(self):
+        if self.options.mark_mode == "pattern":
+            return self.mark_matching_sprites()
 
         if len(self.svg.selection) == 0: 
             self.debug("Nothing selected, cancelling")
@@ -36,30 +51,69 @@ class MarkIsoSprite(inkex.EffectExtension):
             if isinstance(object, inkex.Group):
                 nodes_to_mark.append(object)
 
+        # The origins of the whole document are counted once, not per marked group:
+        recorder.phase("traversal")
+        self.index = IsoIndex(self.svg.getroottree().getroot())
+        self.transforms = utils.TransformCache(self.svg)
+
+        recorder.phase("mark")
         marked = False
         for group in nodes_to_mark:
             self.mark_iso_sprite(group)
             marked = True
+        recorder.count("groups", len(nodes_to_mark))
             
         if not marked:
             self.msg("No groups selected, nothing to mark.")
 
+    def mark_matching_sprites(self):
+        # Marks every group whose label matches the pattern, in one pass over the document:
+        try:
+            pattern = re.compile(self.options.label_pattern)
+        except re.error as error:
+            raise inkex.AbortExtension("Invalid label pattern \"%s\": %s" % (self.options.label_pattern, error))
+
+        recorder.phase("traversal")
+        self.index = IsoIndex(self.svg.getroottree().getroot())
+        self.transforms = utils.TransformCache(self.svg)
+        self.transforms.fill(self.svg.getroottree().getroot())
+        groups = []
+        if not self.options.layer:
+            self.find_matching_groups(self.svg, pattern, groups)
+        for layer in self.svg.iterchildren():
+            if isinstance(layer, inkex.Layer) and layer.get("inkscape:label") == self.options.layer:
+                self.find_matching_groups(layer, pattern, groups)
+        recorder.count("groups", len(groups))
+
+        if len(groups) == 0:
+            self.msg("No groups match, nothing to mark.")
+            return
+
+        # The old origins go first, so the new ones are numbered in a single sweep:
+        recorder.phase("mark")
+        for group in groups:
+            self.index.remove_origins(group)
+
+        for group in groups:
+            self.mark_iso_sprite(group)
+
+    def find_matching_groups(self, node, pattern, groups):
+        for child in node.iterchildren():
+            if isinstance(child, inkex.Layer): # Searched, but a layer is never a sprite
+                self.find_matching_groups(child, pattern, groups)
+            elif isinstance(child, inkex.Group):
+                label = child.get("inkscape:label") or child.get_id()
+                if not pattern.search(label):
+                    self.find_matching_groups(child, pattern, groups)
+                elif not (self.options.skip_marked and self.index.is_iso(child)):
+                    groups.append(child) # Not searched further, its groups are parts of the sprite
+
     def mark_iso_sprite(self, group):
         # Remove the old origin if present:
-        for child in group.iterchildren():
-            name = child.get("inkscape:label")
-            if name is None: continue
-            if f"[{ISO_ORIGIN_TITLE}]" in name:
-                group.remove(child) # Remove the old origin
+        self.index.remove_origins(group)
 
         # Find the next number of iso origin
-        root = self.svg.getroottree().getroot()
-        number = 0
-        for element in root.iter():
-            name = element.get("inkscape:label")
-            if name is None: continue
-            if f"[{ISO_ORIGIN_TITLE}]" in name:
-                number += 1
+        number = self.index.next_number()
 
         iso_origin_name = "[%s][#%d][Z=%.4f]"  % (ISO_ORIGIN_TITLE, number, self.options.z_value)
 
@@ -75,13 +129,15 @@ class MarkIsoSprite(inkex.EffectExtension):
             iso_origin.attrib["style"] = "display:none"
 
         # Do the changes and reload the SVG:
-        self.svg.selection.set(iso_origin, group)
+        if self.options.mark_mode == "selection":
+            self.svg.selection.set(iso_origin, group)
 
         # self.center_iso_origin_1(group, iso_origin) 
         self.position_iso_origin(group, iso_origin)
         
         # Append the origin to the group:
         group.append(iso_origin)
+        self.index.add_origin(group, iso_origin)
 
         return None # This get's ignored whatsoever by the ExtensionBase.
 
@@ -92,7 +148,7 @@ class MarkIsoSprite(inkex.EffectExtension):
         absolute_position = self.get_origin_absolute_position(group)
         translation_transform = inkex.Transform(translate=absolute_position)
         try:
-            parent_transform = group.composed_transform()
+            parent_transform = self.transforms.composed(group)
         except AttributeError:
             self.debug("ATTRIBUTE ERROR")
             pass
@@ -100,13 +156,12 @@ class MarkIsoSprite(inkex.EffectExtension):
             transform = -parent_transform @ translation_transform
 
         iso_origin.transform = transform
+        self.transforms.invalidate(iso_origin)
 
     def get_origin_absolute_position(self, group):
         # Calculate the new position of origin (this is not accurate, because the bounds are not visual bounds in the inkscape's language):
-        parent_transform = inkex.Transform()
-        parent = group.getparent()
-        if parent is not None:
-            parent_transform = parent.composed_transform()
+        # Siblings share their parent's transform, the cache composes it only once:
+        parent_transform = self.transforms.composed(group.getparent())
         bbox = group.bounding_box(parent_transform)
 
         center_x = 0
@@ -151,6 +206,6 @@ if __name__ == '__main__':
     if running_in_inkscape:
         extension.run()
     else:
-        extension.run(["testassets/world.svg", "--output=" +  "testassets/world_changed.svg"])
+        extension.run(["testassets/world.svg", "--output=" +  "testassets/world_changed.svg", "--id=g60"])
 
     
\ No newline at end of file
@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import math
+from array import array
+from argparse import ArgumentParser
+
+import curve_format
+from arc_length import curve_lengths
+
+NAV_GRAPH_VERSION = 1
+NAV_GRAPH_SUFFIX = "_nav.json"
+
+
+def nav_graph_filename(export_path):
+    return os.path.splitext(export_path)[0] + NAV_GRAPH_SUFFIX
+
+
+class EndpointSnapper:
+    """Spatial hash merging the curve endpoints closer than the tolerance into one node"""
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.cell_size = tolerance if tolerance > 0 else 1e-9
+        self.cells = {} # A map from cell to the indices of its nodes
+        self.nodes = [] # The (x, y, z) of the first endpoint of each node
+
+    def node(self, x, y, z):
+        cell = (math.floor(x / self.cell_size), math.floor(y / self.cell_size), math.floor(z / self.cell_size))
+        # Anything within the tolerance is at most one cell away:
+        best = None
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    for index in self.cells.get((cell[0] + dx, cell[1] + dy, cell[2] + dz), ()):
+                        distance = math.dist(self.nodes[index], (x, y, z))
+                        if distance <= self.tolerance and (best is None or distance < best[0]):
+                            best = (distance, index)
+        if best is not None:
+            return best[1]
+        self.nodes.append((x, y, z))
+        self.cells.setdefault(cell, []).append(len(self.nodes) - 1)
+        return len(self.nodes) - 1
+
+
+class NavGraphWriter:
+    """Collects the curves as they are exported, close() writes their connectivity graph.
+    Only the control points, flags and tags are kept per curve."""
+
+    def __init__(self, filename, tolerance=0.01):
+        self.filename = filename
+        self.tolerance = tolerance
+        self.points = array("d")
+        self.directions = bytearray() # 1 forward, 0 reverse, 2 both ways
+        self.starts = []
+        self.ends = []
+        self.tag_ids = array("i")
+        self.tags = {} # A map from the tags string to its index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, curve):
+        index = len(self.directions)
+        for name in curve_format.CONTROL_POINTS:
+            control_point = curve[name]
+            self.points.extend((control_point["x"], control_point["y"], control_point["z"]))
+        self.directions.append(2 if "forward" not in curve else 1 if curve["forward"] else 0)
+        if curve.get("start"):
+            self.starts.append(index)
+        if curve.get("end"):
+            self.ends.append(index)
+        tags = curve.get("tags")
+        self.tag_ids.append(curve_format.NO_TAGS if tags is None else self.tags.setdefault(tags, len(self.tags)))
+
+    def close(self):
+        if self.points is None:
+            return
+        write_nav_graph(self.filename, build_nav_graph(
+            self.points, self.directions, self.starts, self.ends, self.tag_ids, list(self.tags), self.tolerance))
+        self.points = None
+
+
+def build_nav_graph(points, directions, starts, ends, tag_ids, tags, tolerance):
+    """The graph as a JSON-ready dict: the snapped nodes, the directed edges and per node its outgoing edges"""
+    snapper = EndpointSnapper(tolerance)
+    lengths = curve_lengths(points)
+    edges = {"from": [], "to": [], "curve": [], "length": [], "tag": []}
+    first_nodes = []
+    last_nodes = []
+    for curve, length in enumerate(lengths):
+        first = snapper.node(*points[curve * 12:curve * 12 + 3])
+        last = snapper.node(*points[curve * 12 + 9:curve * 12 + 12])
+        first_nodes.append(first)
+        last_nodes.append(last)
+        # A reversed path is driven from its end to its start:
+        if directions[curve] == 1:
+            pairs = [(first, last)]
+        elif directions[curve] == 0:
+            pairs = [(last, first)]
+        else:
+            pairs = [(first, last), (last, first)]
+        for source, target in pairs:
+            edges["from"].append(source)
+            edges["to"].append(target)
+            edges["curve"].append(curve)
+            edges["length"].append(length)
+            edges["tag"].append(tag_ids[curve])
+
+    adjacency = [[] for node in snapper.nodes]
+    for edge, source in enumerate(edges["from"]):
+        adjacency[source].append(edge)
+
+    return {
+        "version": NAV_GRAPH_VERSION,
+        "tolerance": tolerance,
+        "nodes": [list(node) for node in snapper.nodes],
+        "edges": edges,
+        "adjacency": adjacency,
+        "tags": tags,
+        # The nodes under the start and end markers of the paths:
+        "starts": sorted(set(first_nodes[curve] for curve in starts)),
+        "ends": sorted(set(last_nodes[curve] for curve in ends)),
+    }
+
+
+def write_nav_graph(filename, graph):
+    with open(filename + ".tmp", "w") as f:
+        json.dump(graph, f, separators=(",", ":"))
+    os.replace(filename + ".tmp", filename)
+
+
+if __name__ == "__main__":
+    # Builds the graph of already exported curves, JSON or binary, no Inkscape needed:
+    parser = ArgumentParser(description="Build the navigation graph of exported ISO curves")
+    parser.add_argument("curves", help="The exported curves, .json or %s" % curve_format.BINARY_EXTENSION)
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Endpoints closer than this, in iso units, are one node")
+    arguments = parser.parse_args()
+
+    if arguments.curves.endswith(curve_format.BINARY_EXTENSION):
+        curves = curve_format.read_curves(arguments.curves)
+    else:
+        with open(arguments.curves, "r") as f:
+            curves = json.load(f)
+    filename = nav_graph_filename(arguments.curves)
+    with NavGraphWriter(filename, arguments.tolerance) as writer:
+        for curve in curves:
+            writer.write(curve)
+    sys.stdout.write("Written %s\n" % filename)
@@ -0,0 +1,105 @@
+import os
+import sys
+import json
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+from sprite_manifest import MANIFEST_FILENAME, read_sprite_descriptions, write_manifest
+
+
+def process_image(image_filename, anchor, trim=True, colors=0, recompress=True):
+    """Trims, quantizes and recompresses the PNG in place.
+    Returns the anchor and size moved to the new image and the file sizes before and after."""
+    size_before = os.path.getsize(image_filename)
+    with Image.open(image_filename) as opened:
+        image = opened.convert("RGBA")
+    width, height = image.size
+    # The anchor in pixels, it has to stay on the same pixel of the (trimmed) image:
+    anchor_x = anchor["anchorX"] * width
+    anchor_y = anchor["anchorY"] * height
+
+    changed = False
+    if trim:
+        box = image.getchannel("A").getbbox() # None for a fully transparent image, nothing to keep
+        if box is not None and box != (0, 0, width, height):
+            image = image.crop(box)
+            anchor_x -= box[0]
+            anchor_y -= box[1]
+            width, height = image.size
+            changed = True
+    if colors:
+        image = image.quantize(colors, method=Image.Quantize.FASTOCTREE)
+        changed = True
+
+    if changed or recompress:
+        temporary_filename = image_filename + ".tmp"
+        image.save(temporary_filename, format="PNG", optimize=recompress)
+        # A recompression that doesn't pay off keeps the original:
+        if changed or os.path.getsize(temporary_filename) < size_before:
+            os.replace(temporary_filename, image_filename)
+        else:
+            os.remove(temporary_filename)
+
+    anchor = {"anchorX": anchor_x / width, "anchorY": anchor_y / height}
+    size = {"width": width, "height": height}
+    return anchor, size, size_before, os.path.getsize(image_filename)
+
+
+def process_sprite(export_path, sprite, trim, colors, recompress):
+    image_filename = os.path.join(export_path, sprite["image"])
+    if not os.path.exists(image_filename): # Failed to export
+        return None
+    return process_image(image_filename, sprite["anchor"], trim, colors, recompress)
+
+
+def postprocess_sprites(export_path, sprites, trim=True, colors=0, recompress=True, jobs=1):
+    """Post-processes the images of the sprites in a process pool, updates their anchor and size.
+    Returns the number of bytes saved."""
+    # Each resolution has its own image, anchor and size, the first one is also the sprite's own:
+    entries = []
+    for sprite in sprites:
+        entries += sprite.get("resolutions", [sprite])
+
+    arguments = (trim, colors, recompress)
+    if jobs <= 1 or len(entries) <= 1:
+        results = [process_sprite(export_path, entry, *arguments) for entry in entries]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(process_sprite, export_path, entry, *arguments) for entry in entries]
+            results = [future.result() for future in futures]
+
+    saved = 0
+    for entry, result in zip(entries, results):
+        if result is None:
+            continue
+        entry["anchor"], entry["size"], size_before, size_after = result
+        saved += size_before - size_after
+    for sprite in sprites:
+        if "resolutions" in sprite:
+            sprite["anchor"] = sprite["resolutions"][0]["anchor"]
+            sprite["size"] = sprite["resolutions"][0]["size"]
+    return saved
+
+
+if __name__ == "__main__":
+    # Works on an existing export directory, no Inkscape needed:
+    parser = ArgumentParser(description="Trim, quantize and recompress exported ISO sprites, keeping their placement")
+    parser.add_argument("export_path")
+    parser.add_argument("--no_trim", action="store_true")
+    parser.add_argument("--colors", type=int, default=0, help="Quantize to a palette of this many colors, 0 keeps RGBA")
+    parser.add_argument("--no_recompress", action="store_true")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--manifest", action="store_true", help="Update %s instead of the .spr files" % MANIFEST_FILENAME)
+    arguments = parser.parse_args()
+
+    sprites = read_sprite_descriptions(arguments.export_path, arguments.manifest)
+    saved = postprocess_sprites(arguments.export_path, sprites, not arguments.no_trim, arguments.colors,
+        not arguments.no_recompress, arguments.jobs)
+    if arguments.manifest:
+        write_manifest(os.path.join(arguments.export_path, MANIFEST_FILENAME), sprites)
+    else:
+        for sprite in sprites:
+            with open(os.path.join(arguments.export_path, sprite["name"] + ".spr"), "w") as f:
+                json.dump(sprite, f, indent = 2)
+    sys.stdout.write("Processed %d sprites, saved %d bytes\n" % (len(sprites), saved))
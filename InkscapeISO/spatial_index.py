@@ -0,0 +1,173 @@
+import os
+import sys
+import math
+import struct
+from array import array
+from argparse import ArgumentParser
+
+from iso_projection import project
+from mapped_file import MappedFile, align, write_array, write_strings
+from sprite_manifest import read_sprite_descriptions
+
+# Static packed R-tree over the sprite footprints, all little-endian:
+#   header      - see HEADER below, offsets are from the start of the file
+#   boxes       - per node min x, min y, max x, max y as float64, the leaves (one per sprite) first,
+#                 then each level of parents up to the root, which is the last node
+#   indices     - per node an uint32, the sprite index for the leaves, the first child for the parents
+#   levels      - per level the uint32 end of its nodes, starting with the leaves
+#   names       - per sprite an uint32 byte length followed by the utf-8 name
+# The footprints are the sprite rectangles on the canvas, in document pixels relative to the world
+# center, the space iso_projection.project() maps the iso locations to. Sections are 8-byte aligned.
+MAGIC = b"ISOS"
+VERSION = 1
+SPATIAL_INDEX_FILENAME = "sprites.isos"
+HEADER = struct.Struct("<4sHHIIIQQQQ") # magic, version, node size, sprite count, node count, level count, 4 section offsets
+DEFAULT_NODE_SIZE = 16
+
+
+def sprite_footprint(sprite, htw, hth, v_step, dpi):
+    """The (min x, min y, max x, max y) of the sprite on the canvas, from its .spr description"""
+    location = sprite["location"]
+    x, y = project(location["x"], location["y"], location["z"], htw, hth, v_step)
+    # The size is in exported pixels:
+    width = sprite["size"]["width"] * 96.0 / dpi
+    height = sprite["size"]["height"] * 96.0 / dpi
+    left = x - sprite["anchor"]["anchorX"] * width
+    top = y - sprite["anchor"]["anchorY"] * height
+    return (left, top, left + width, top + height)
+
+
+def sort_tile_recursive(boxes, node_size):
+    # Vertical slices by the box centers, each slice sorted top to bottom:
+    leaf_count = math.ceil(len(boxes) / node_size)
+    slice_size = math.ceil(math.sqrt(leaf_count)) * node_size
+    by_x = sorted(range(len(boxes)), key=lambda i: boxes[i][0] + boxes[i][2])
+    order = []
+    for start in range(0, len(boxes), slice_size):
+        order += sorted(by_x[start:start + slice_size], key=lambda i: boxes[i][1] + boxes[i][3])
+    return order
+
+
+def pack(boxes, node_size=DEFAULT_NODE_SIZE):
+    """Returns the nodes' boxes, the nodes' indices and the level ends of the packed tree"""
+    if not boxes:
+        return [], [], []
+    indices = sort_tile_recursive(boxes, node_size)
+    nodes = [boxes[i] for i in indices]
+    levels = [len(nodes)]
+    level_start = 0
+    # Even a single leaf gets a parent, so the root is never a leaf:
+    while True:
+        level_end = len(nodes)
+        for first in range(level_start, level_end, node_size):
+            children = nodes[first:min(first + node_size, level_end)]
+            nodes.append((
+                min(box[0] for box in children), min(box[1] for box in children),
+                max(box[2] for box in children), max(box[3] for box in children),
+            ))
+            indices.append(first)
+        levels.append(len(nodes))
+        if len(nodes) - level_end == 1:
+            break
+        level_start = level_end
+    return nodes, indices, levels
+
+
+def write_spatial_index(filename, names, boxes, node_size=DEFAULT_NODE_SIZE):
+    nodes, indices, levels = pack(boxes, node_size)
+    temporary_filename = filename + ".tmp"
+    with open(temporary_filename, "wb") as f:
+        f.write(b"\0" * HEADER.size) # Filled in at the end
+        boxes_offset = align(f)
+        write_array(f, array("d", [coordinate for box in nodes for coordinate in box]))
+        indices_offset = align(f)
+        write_array(f, array("I", indices))
+        levels_offset = align(f)
+        write_array(f, array("I", levels))
+        names_offset = align(f)
+        write_strings(f, names)
+
+        f.seek(0)
+        f.write(HEADER.pack(
+            MAGIC, VERSION, node_size, len(names), len(nodes), len(levels),
+            boxes_offset, indices_offset, levels_offset, names_offset,
+        ))
+    os.replace(temporary_filename, filename)
+
+
+def write_sprites_index(export_path, sprites, htw, hth, v_step, dpi, node_size=DEFAULT_NODE_SIZE):
+    """Indexes the sprites, the descriptions of one export, returns the index filename"""
+    names = [sprite["name"] for sprite in sprites]
+    boxes = [sprite_footprint(sprite, htw, hth, v_step, dpi) for sprite in sprites]
+    filename = os.path.join(export_path, SPATIAL_INDEX_FILENAME)
+    write_spatial_index(filename, names, boxes, node_size)
+    return filename
+
+
+class SpatialIndex(MappedFile):
+    """Memory-mapped packed R-tree, search() returns the names of the sprites in a rectangle"""
+
+    ARRAYS = ("boxes", "indices")
+
+    def __init__(self, filename):
+        MappedFile.__init__(self, filename)
+        (magic, version, self.node_size, self.count, self.node_count, level_count,
+            boxes_offset, indices_offset, levels_offset, names_offset) = HEADER.unpack_from(self.mapping, 0)
+        if magic != MAGIC:
+            raise ValueError("Not an ISO spatial index: %s" % filename)
+        if version > VERSION:
+            raise ValueError("Unsupported ISO spatial index version %d" % version)
+
+        self.boxes = self.array(boxes_offset, self.node_count * 4, "d") # Flat, 4 coordinates per node
+        self.indices = self.array(indices_offset, self.node_count, "I")
+        self.levels = list(struct.unpack_from("<%dI" % level_count, self.mapping, levels_offset))
+        self.names = self.strings(names_offset, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def search(self, min_x, min_y, max_x, max_y):
+        """The names of the sprites whose footprints intersect the rectangle"""
+        if self.node_count == 0:
+            return []
+        results = []
+        boxes = self.boxes
+        stack = [(self.node_count - 1, len(self.levels) - 1)] # (node, level), the root first
+        while stack:
+            node, level = stack.pop()
+            first = int(self.indices[node])
+            end = min(first + self.node_size, self.levels[level - 1])
+            for child in range(first, end):
+                b = child * 4
+                if boxes[b] > max_x or boxes[b + 1] > max_y or boxes[b + 2] < min_x or boxes[b + 3] < min_y:
+                    continue
+                if level == 1:
+                    results.append(self.names[int(self.indices[child])])
+                else:
+                    stack.append((child, level - 1))
+        return results
+
+
+if __name__ == "__main__":
+    # Builds the index of an existing export directory, or queries one:
+    parser = ArgumentParser(description="Build or query the spatial index of exported ISO sprites")
+    parser.add_argument("export_path")
+    parser.add_argument("--tile_width", type=int, default=256)
+    parser.add_argument("--tile_height", type=int, default=128)
+    parser.add_argument("--vertical_step", type=int, default=128)
+    parser.add_argument("--export_dpi", type=float, default=96.0)
+    parser.add_argument("--manifest", action="store_true", help="Read the sprites from the manifest instead of the .spr files")
+    parser.add_argument("--query", type=float, nargs=4, metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"), default=None)
+    arguments = parser.parse_args()
+
+    filename = os.path.join(arguments.export_path, SPATIAL_INDEX_FILENAME)
+    if arguments.query is None:
+        sprites = read_sprite_descriptions(arguments.export_path, arguments.manifest)
+        write_sprites_index(arguments.export_path, sprites, arguments.tile_width / 2, arguments.tile_height / 2,
+            arguments.vertical_step, arguments.export_dpi)
+    with SpatialIndex(filename) as index:
+        if arguments.query is None:
+            sys.stdout.write("Indexed %d sprites\n" % len(index))
+        else:
+            for name in index.search(*arguments.query):
+                sys.stdout.write(name + "\n")
@@ -0,0 +1,186 @@
+import os
+import re
+import json
+import hashlib
+from lxml import etree
+from iso_index import is_iso_origin
+
+# The cache lives in the export directory, next to the .spr/.png files it describes.
+CACHE_FILENAME = ".iso_sprite_cache.json"
+CACHE_VERSION = 1
+
+# Attributes that name an element without changing how it looks:
+IGNORED_NAMESPACES = ("{http://www.inkscape.org/namespaces/inkscape}", "{http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd}")
+
+
+# References to other elements, hashed by the content of the element instead of its id:
+URL_REGEX = re.compile(r"url\(\s*['\"]?#([^)'\"\s]+)['\"]?\s*\)")
+HREF_KEYS = ("{http://www.w3.org/1999/xlink}href", "href")
+FIND_BY_ID = etree.XPath("//*[@id=$id]")
+
+
+def hash_attributes(hasher, element, skip_transform=False, resolve=None):
+    for key, value in sorted(element.attrib.items()):
+        if key == "id" or key.startswith(IGNORED_NAMESPACES) or (skip_transform and key == "transform"):
+            continue
+        if resolve is not None:
+            if key in HREF_KEYS and value.startswith("#"):
+                value = resolve(value[1:])
+            else:
+                value = URL_REGEX.sub(lambda match: "url(%s)" % resolve(match.group(1)), value)
+        hasher.update(("%s=%s;" % (key, value)).encode("utf-8"))
+
+
+def hash_ancestors(hasher, group, resolve=None):
+    # What the group inherits (style, class, clip-path, mask, filter...), their transforms are in the composed one:
+    for ancestor in group.iterancestors():
+        hash_attributes(hasher, ancestor, skip_transform=True, resolve=resolve)
+        hasher.update(b"<")
+
+
+def hash_children(hasher, element, resolve=None, skip=None):
+    for child in element.iterchildren():
+        if not isinstance(child.tag, str) or (skip is not None and skip(child)):
+            continue # Comments, processing instructions...
+        hasher.update(("<%s>" % child.tag).encode("utf-8"))
+        hash_attributes(hasher, child, resolve=resolve)
+        if child.text:
+            hasher.update(child.text.encode("utf-8"))
+        hash_children(hasher, child, resolve)
+        # Without the nesting two different trees could give the same sequence:
+        hasher.update(b">")
+
+
+def definition_hash(root, element_id, digests):
+    """The content of the referenced element (a gradient, a filter...) and of what it references in turn,
+    without the ids. The digests are kept by id, clones of the same definition get the same one."""
+    if element_id not in digests:
+        digests[element_id] = element_id # Until it's done, a reference cycle hashes the id
+        resolve = lambda reference: definition_hash(root, reference, digests)
+        hasher = hashlib.sha1()
+        for element in FIND_BY_ID(root, id=element_id)[:1]:
+            hasher.update(("<%s>" % element.tag).encode("utf-8"))
+            hash_attributes(hasher, element, resolve=resolve)
+            hash_children(hasher, element, resolve)
+        digests[element_id] = hasher.hexdigest()
+    return digests[element_id]
+
+
+def appearance_hash(group, transform, digests=None):
+    """Equal for groups that render to the same image wherever they are: the same subtree without its ids,
+    labels and origin, the same definitions referenced, the same styles inherited from the ancestors
+    and the same composed transform but the translation. The digests of the definitions can be shared
+    between the calls."""
+    root = group.getroottree().getroot()
+    digests = {} if digests is None else digests
+    resolve = lambda element_id: definition_hash(root, element_id, digests)
+    hasher = hashlib.sha1()
+    hash_ancestors(hasher, group, resolve)
+    # The group's own transform is part of the composed one:
+    hash_attributes(hasher, group, skip_transform=True, resolve=resolve)
+    # The origin is placed by hand, it's hidden during the export anyway:
+    hash_children(hasher, group, resolve, skip=is_iso_origin)
+    hasher.update(("%.6f %.6f %.6f %.6f" % (transform.a, transform.b, transform.c, transform.d)).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+class SpriteCache:
+    """Content hashes of the exported ISO groups, used to skip unchanged groups"""
+
+    def __init__(self, export_path, settings, outputs=(".spr", ".png"), transforms=None):
+        self.filename = os.path.join(export_path, CACHE_FILENAME)
+        self.export_path = export_path
+        self.outputs = outputs # The extensions of the files written per group
+        self.transforms = transforms # The exporter's utils.TransformCache, if any
+        # Everything outside of the group that influences the output (dpi, world settings...):
+        self.settings_digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()
+        self.entries = {} # A map from group id to {"hash": ..., "name": ...}
+        self.pending = {} # Hashes computed in this run, committed by update()
+        self.stale = [] # The replaced and forgotten entries, their outputs are removed by prune()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return # A broken cache just means a full export.
+        if data.get("version") != CACHE_VERSION:
+            return
+        self.entries = data.get("groups", {})
+
+    def save(self):
+        data = {"version": CACHE_VERSION, "groups": self.entries}
+        temporary_filename = self.filename + ".tmp"
+        with open(temporary_filename, "w") as f:
+            json.dump(data, f)
+        os.replace(temporary_filename, self.filename)
+
+    def group_hash(self, group):
+        hasher = hashlib.sha1()
+        hasher.update(self.settings_digest.encode("utf-8"))
+        hash_ancestors(hasher, group)
+        # Before the serialization, inkex rewrites the transform attributes it parses:
+        transform = self.transforms.composed(group) if self.transforms is not None else group.composed_transform()
+        hasher.update(etree.tostring(group))
+        hasher.update(str(transform).encode("utf-8"))
+        return hasher.hexdigest()
+
+    def is_dirty(self, group):
+        group_id = group.get_id()
+        group_hash = self.group_hash(group)
+        self.pending[group_id] = group_hash
+
+        entry = self.entries.get(group_id)
+        if entry is None:
+            return True
+        image_name = getattr(group, "image_name", group.name) # The copies of a group share its images
+        if entry["hash"] != group_hash or entry["name"] != group.name or entry.get("image", group.name) != image_name:
+            return True
+        # The layer labels aren't hashed, a renamed layer or a move to a look-alike one changes the .spr only:
+        if entry.get("layer_name") != getattr(group, "layer_name", None):
+            return True
+
+        # The outputs might have been deleted by hand:
+        for extension in self.outputs:
+            name = group.name if extension == ".spr" else image_name
+            if not os.path.exists(os.path.join(self.export_path, name + extension)):
+                return True
+        return False
+
+    def update(self, groups):
+        for group_id, group in groups.items():
+            if group_id in self.entries:
+                self.stale.append(self.entries[group_id]) # Renamed groups leave their old files behind
+            self.entries[group_id] = {
+                "hash": self.pending[group_id],
+                "name": group.name,
+                "image": getattr(group, "image_name", group.name),
+                "layer_name": getattr(group, "layer_name", None),
+            }
+
+    def forget(self, groups_ids):
+        # The groups were deleted from the document, or are no longer ISO groups:
+        for group_id in groups_ids:
+            if group_id in self.entries:
+                self.stale.append(self.entries.pop(group_id))
+
+    def prune(self):
+        """Removes the outputs of the replaced and forgotten entries that no current entry uses anymore,
+        returns the names of the removed sprites"""
+        names = set(entry["name"] for entry in self.entries.values())
+        images = set(entry.get("image", entry["name"]) for entry in self.entries.values())
+        removed = set()
+        for entry in self.stale:
+            image = entry.get("image", entry["name"])
+            for extension in self.outputs:
+                name, used = (entry["name"], names) if extension == ".spr" else (image, images)
+                filename = os.path.join(self.export_path, name + extension)
+                if name not in used and os.path.exists(filename):
+                    os.remove(filename)
+            if entry["name"] not in names:
+                removed.add(entry["name"])
+        self.stale = []
+        return removed
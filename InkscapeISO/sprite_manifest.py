@@ -0,0 +1,178 @@
+import os
+import json
+import zlib
+import struct
+
+# All the sprite records in one JSON Lines file, next to the .spr/.png files:
+MANIFEST_FILENAME = "sprites.jsonl"
+
+# The binary offset index (<manifest>.idx), all little-endian:
+#   header      - see INDEX_HEADER below, the manifest's size and crc32 tell if the index is stale
+#   entries     - per record its offset and length in the manifest, the utf-8 name length and the name
+INDEX_EXTENSION = ".idx"
+INDEX_MAGIC = b"ISOM"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<4sHIQI") # magic, version, record count, manifest size, manifest crc32
+INDEX_ENTRY = struct.Struct("<QIH") # offset, length, name length
+
+
+class ManifestWriter:
+    """Streams the records to temporary files, close() renames them over the previous manifest"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename + ".tmp", "wb")
+        self.entries = [] # (name, offset, length)
+        self.size = 0
+        self.crc = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, *args):
+        if error_type is None:
+            self.close()
+        else: # Leave the previous manifest alone
+            self.file.close()
+            os.remove(self.filename + ".tmp")
+
+    def write(self, record):
+        line = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        self.entries.append((record["name"], self.size, len(line)))
+        self.file.write(line + b"\n")
+        self.size += len(line) + 1
+        self.crc = zlib.crc32(line + b"\n", self.crc)
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+
+        index_filename = self.filename + INDEX_EXTENSION
+        with open(index_filename + ".tmp", "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(self.entries), self.size, self.crc))
+            for name, offset, length in self.entries:
+                encoded = name.encode("utf-8")
+                f.write(INDEX_ENTRY.pack(offset, length, len(encoded)))
+                f.write(encoded)
+
+        # The manifest is complete on its own, a reader that finds a stale index rebuilds it:
+        os.replace(self.filename + ".tmp", self.filename)
+        os.replace(index_filename + ".tmp", index_filename)
+
+
+class SpriteManifest:
+    """Reads single records through the offset index, without parsing the whole manifest"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "rb")
+        self.offsets = self.read_index() # A map from sprite name to (offset, length)
+        if self.offsets is None:
+            self.offsets = self.scan()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, name):
+        return name in self.offsets
+
+    def close(self):
+        self.file.close()
+
+    def read_index(self):
+        index_filename = self.filename + INDEX_EXTENSION
+        if not os.path.exists(index_filename):
+            return None
+        with open(index_filename, "rb") as f:
+            data = f.read()
+        if len(data) < INDEX_HEADER.size:
+            return None
+        magic, version, count, size, crc = INDEX_HEADER.unpack_from(data, 0)
+        if magic != INDEX_MAGIC or version > INDEX_VERSION or size != os.fstat(self.file.fileno()).st_size:
+            return None
+        # Checksumming is a lot cheaper than parsing, it catches an index left over from an interrupted run:
+        if self.checksum() != crc:
+            return None
+
+        offsets = {}
+        position = INDEX_HEADER.size
+        for i in range(count):
+            offset, length, name_length = INDEX_ENTRY.unpack_from(data, position)
+            position += INDEX_ENTRY.size
+            offsets[data[position:position + name_length].decode("utf-8")] = (offset, length)
+            position += name_length
+        return offsets
+
+    def checksum(self):
+        crc = 0
+        self.file.seek(0)
+        for block in iter(lambda: self.file.read(1 << 20), b""):
+            crc = zlib.crc32(block, crc)
+        return crc
+
+    def scan(self):
+        offsets = {}
+        offset = 0
+        self.file.seek(0)
+        for line in self.file:
+            if line.strip():
+                offsets[json.loads(line)["name"]] = (offset, len(line.rstrip(b"\n")))
+            offset += len(line)
+        return offsets
+
+    def names(self):
+        return list(self.offsets.keys())
+
+    def get(self, name):
+        offset, length = self.offsets[name]
+        self.file.seek(offset)
+        return json.loads(self.file.read(length))
+
+    def records(self):
+        self.file.seek(0)
+        return [json.loads(line) for line in self.file if line.strip()]
+
+
+def write_manifest(filename, records, keep_existing=False, removed=()):
+    """Writes the records, with keep_existing the records of the other sprites stay in the manifest,
+    but for the removed names"""
+    records = list(records)
+    if keep_existing and os.path.exists(filename):
+        names = set(record["name"] for record in records).union(removed)
+        with SpriteManifest(filename) as previous:
+            records = [record for record in previous.records() if record["name"] not in names] + records
+
+    with ManifestWriter(filename) as writer:
+        for record in records:
+            writer.write(record)
+
+
+def read_sprite_descriptions(export_path, use_manifest=False, names=None):
+    """The sprites of an export directory, from its manifest or its .spr files, sorted by name.
+    With names only those sprites are read, the missing ones are skipped."""
+    descriptions = []
+    if use_manifest:
+        with SpriteManifest(os.path.join(export_path, MANIFEST_FILENAME)) as manifest:
+            if names is None:
+                descriptions = manifest.records()
+            else:
+                descriptions = [manifest.get(name) for name in names if name in manifest]
+    else:
+        if names is None:
+            names = [filename[:-len(".spr")] for filename in os.listdir(export_path) if filename.endswith(".spr")]
+        for name in names:
+            filename = os.path.join(export_path, name + ".spr")
+            if not os.path.exists(filename):
+                continue
+            with open(filename, "r") as f:
+                descriptions.append(json.load(f))
+    # The same order either way, the indices of the draw order point into it:
+    return sorted(descriptions, key=lambda sprite: sprite["name"])
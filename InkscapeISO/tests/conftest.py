@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules sit flat in the extension directory, the way Inkscape imports them:
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
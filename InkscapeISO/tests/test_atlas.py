@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+pytest.importorskip("PIL") # The packing itself doesn't need it, the module does
+from PIL import Image
+
+import atlas
+
+
+def test_packing_without_overlaps():
+    rng = random.Random(3)
+    sizes = [(rng.randint(1, 300), rng.randint(1, 300)) for i in range(300)] + [(1500, 40), (3000, 10)]
+    padding = 2
+    placements, packers = atlas.pack_sprites(sizes, 1024, padding)
+
+    rectangles = {} # A map from sheet index to the padded rectangles on it
+    for (width, height), (sheet_index, x, y) in zip(sizes, placements):
+        packer = packers[sheet_index]
+        left, top, right, bottom = x - padding, y - padding, x + width + padding, y + height + padding
+        assert left >= 0 and top >= 0 and right <= packer.width and bottom <= packer.height
+        assert right <= packer.used_width and bottom <= packer.used_height
+        for other in rectangles.get(sheet_index, []):
+            assert right <= other[0] or other[2] <= left or bottom <= other[1] or other[3] <= top
+        rectangles.setdefault(sheet_index, []).append((left, top, right, bottom))
+    # The oversized one gets a sheet of its own:
+    assert packers[placements[-1][0]].width == 4096
+
+
+def test_shared_images_are_packed_once(tmp_path):
+    colors = {"tree": (0, 255, 0, 255), "house": (255, 0, 0, 255)}
+    for name, color in colors.items():
+        Image.new("RGBA", (10, 20), color).save(str(tmp_path / (name + ".png")))
+    sprites = []
+    for name, image in (("house", "house"), ("tree", "tree"), ("tree#2", "tree"), ("gone", "gone")):
+        sprites.append({
+            "name": name, "layer_name": "Objects", "image": image + ".png",
+            "location": {"x": 0, "y": 0, "z": 0}, "anchor": {"anchorX": 0.5, "anchorY": 1.0},
+            "size": {"width": 10, "height": 20},
+        })
+
+    manifest = atlas.build_atlas(str(tmp_path), sprites, max_size=64, padding=1)
+    entries = {entry["name"]: entry for entry in manifest["sprites"]}
+    # The sprite without an image is left out, the copies point at the same pixels:
+    assert sorted(entries) == ["house", "tree", "tree#2"]
+    assert entries["tree"]["rect"] == entries["tree#2"]["rect"]
+    assert entries["tree"]["rect"] != entries["house"]["rect"]
+
+    with Image.open(str(tmp_path / manifest["sheets"][0]["image"])) as sheet:
+        for name in ("tree", "house"):
+            rect = entries[name]["rect"]
+            assert sheet.getpixel((rect["x"] + 5, rect["y"] + 10)) == colors[name]
@@ -0,0 +1,105 @@
+import io
+import types
+
+import inkex
+import pytest
+
+import utils
+from bbox_engine import VisualBoundingBoxEngine, compare_bounding_boxes
+from export_iso_sprite import ExportIsoSprite
+
+# In pixels and without a viewBox, the user units are the exported pixels:
+DOCUMENT = """<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" width="1000px" height="1000px">
+  <defs>
+    <marker id="arrow" markerUnits="userSpaceOnUse" refX="0" refY="0" orient="auto">
+      <rect x="-3" y="-4" width="6" height="8"/>
+    </marker>
+    <clipPath id="clip"><rect x="10" y="20" width="30" height="40" style="stroke:#000000;stroke-width:50"/></clipPath>
+    <symbol id="symbol"><rect width="10" height="10"/></symbol>
+  </defs>
+  <g id="scaled_stroke" transform="scale(2)">
+    <rect width="10" height="10" style="fill:none;stroke:#000000;stroke-width:2"/>
+  </g>
+  <g id="markers">
+    <path d="M 0,0 L 10,0" style="fill:none;stroke:#000000;stroke-width:1;marker-end:url(#arrow)"/>
+  </g>
+  <g id="clipped">
+    <rect width="100" height="100" clip-path="url(#clip)"/>
+  </g>
+  <g id="symbol_use" transform="translate(100,0)">
+    <use xlink:href="#symbol" x="5" y="7"/>
+  </g>
+  <g id="hidden_child">
+    <rect width="10" height="10"/>
+    <rect x="50" y="50" width="10" height="10" style="display:none"/>
+  </g>
+  <g id="nested" transform="translate(10,20)">
+    <g transform="scale(2)">
+      <g transform="translate(1,1)"><rect width="2" height="2"/></g>
+    </g>
+  </g>
+  <g id="inherited_stroke" style="stroke:#000000;stroke-width:4">
+    <rect width="10" height="10"/>
+  </g>
+</svg>"""
+
+EXPECTED = {
+    # The stroke scales with the transform, 2 * 2 wide, half of it outside:
+    "scaled_stroke": (-2, -2, 24, 24),
+    # The marker reaches 5 (its corners from the reference point) around the end point:
+    "markers": (-0.5, -5, 15.5, 10),
+    # Only the clip's geometry counts, not its stroke:
+    "clipped": (10, 20, 30, 40),
+    "symbol_use": (105, 7, 10, 10),
+    "hidden_child": (0, 0, 10, 10),
+    "nested": (12, 22, 4, 4),
+    "inherited_stroke": (-2, -2, 14, 14),
+}
+
+
+@pytest.fixture
+def svg():
+    return inkex.load_svg(io.BytesIO(DOCUMENT.encode("utf-8"))).getroot()
+
+
+def test_known_geometry(svg):
+    bboxes = VisualBoundingBoxEngine(svg).get_bounding_boxes(list(EXPECTED.keys()))
+    for group_id, expected in EXPECTED.items():
+        box = bboxes[group_id]
+        assert (box.x, box.y, box.width, box.height) == pytest.approx(expected), group_id
+
+
+def test_compare_reports_differences_above_the_tolerance():
+    expected = {
+        "same": utils.BoundingBox(0, 0, 10, 10),
+        "close": utils.BoundingBox(0, 0, 10, 10),
+        "moved": utils.BoundingBox(0, 0, 10, 10),
+        "wider": utils.BoundingBox(0, 0, 10, 10),
+        "missing": utils.BoundingBox(0, 0, 10, 10),
+    }
+    actual = {
+        "same": utils.BoundingBox(0, 0, 10, 10),
+        "close": utils.BoundingBox(0.4, -0.4, 10.4, 9.6),
+        "moved": utils.BoundingBox(0, 1, 10, 10),
+        "wider": utils.BoundingBox(0, 0, 10.6, 10),
+    }
+    assert sorted(compare_bounding_boxes(expected, actual, 0.5)) == ["missing", "moved", "wider"]
+
+
+def test_verify_mode_reports_and_trusts_inkscape(svg):
+    engine_bboxes = VisualBoundingBoxEngine(svg).get_bounding_boxes(["nested", "hidden_child"])
+    inkscape_bboxes = {
+        "nested": utils.BoundingBox(12.2, 22, 4, 4),
+        "hidden_child": utils.BoundingBox(0, 0, 60, 60),
+    }
+    session = types.SimpleNamespace(query_bounding_box=lambda group_id: inkscape_bboxes[group_id])
+    groups = {group_id: types.SimpleNamespace(name=group_id) for group_id in engine_bboxes}
+
+    extension = ExportIsoSprite()
+    extension.options = types.SimpleNamespace(bbox_tolerance=0.5)
+    messages = []
+    extension.msg = messages.append
+    bboxes = extension.verify_bounding_boxes(groups, engine_bboxes, session)
+
+    assert len(messages) == 1 and "hidden_child" in messages[0]
+    assert bboxes == inkscape_bboxes
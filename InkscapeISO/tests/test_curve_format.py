@@ -0,0 +1,65 @@
+import json
+
+import curve_format
+import mapped_file
+
+
+def make_curves():
+    curves = []
+    for i in range(5):
+        curve = {}
+        for j, name in enumerate(curve_format.CONTROL_POINTS):
+            # Exact in float32 too:
+            curve[name] = {"x": i + j * 0.25, "y": -i - j * 0.5, "z": j * 0.125}
+        curves.append(curve)
+    curves[0]["start"] = True
+    curves[1]["forward"] = True
+    curves[2]["forward"] = False
+    curves[2]["tags"] = "road;fast"
+    curves[3]["tags"] = "road;fast"
+    curves[4]["tags"] = "rail"
+    curves[4]["end"] = "end"
+    return curves
+
+
+def test_binary_round_trip(tmp_path):
+    curves = make_curves()
+    for double_precision in (False, True):
+        filename = str(tmp_path / ("curves%d.isoc" % double_precision))
+        curve_format.write_curves(filename, curves, double_precision)
+        assert curve_format.read_curves(filename) == curves
+
+
+def test_binary_round_trip_without_numpy(tmp_path, monkeypatch):
+    monkeypatch.setattr(mapped_file, "numpy", None)
+    monkeypatch.setattr(curve_format, "numpy", None)
+    curves = make_curves()
+    filename = str(tmp_path / "curves.isoc")
+    curve_format.write_curves(filename, curves)
+    assert curve_format.read_curves(filename) == curves
+
+
+def test_binary_file_shares_tags(tmp_path):
+    filename = str(tmp_path / "curves.isoc")
+    curve_format.write_curves(filename, make_curves())
+    with curve_format.CurveFile(filename) as curve_file:
+        assert len(curve_file) == 5
+        assert curve_file.tags == ["road;fast", "rail"]
+
+
+def test_binary_round_trip_empty(tmp_path):
+    filename = str(tmp_path / "empty.isoc")
+    curve_format.write_curves(filename, [])
+    assert curve_format.read_curves(filename) == []
+
+
+def test_json_writer_matches_json_dump(tmp_path):
+    curves = make_curves()
+    for count in (0, 1, len(curves)):
+        filename = str(tmp_path / ("curves%d.json" % count))
+        with curve_format.JsonCurveWriter(filename) as writer:
+            for curve in curves[:count]:
+                writer.write(curve)
+        with open(filename) as f:
+            text = f.read()
+        assert text == json.dumps(curves[:count], indent=2)
@@ -0,0 +1,12 @@
+import inkex
+
+from export_iso_curves import get_tags, split_tags
+
+
+def test_tags_are_stripped():
+    path = inkex.PathElement()
+    path.set("inkscape:label", "Road [tags=car, bus ]")
+    assert get_tags(path) == "car, bus "
+    assert split_tags(get_tags(path)) == {"car", "bus"}
+    assert split_tags(" bus,,") == {"bus"}
+    assert split_tags("") == set()
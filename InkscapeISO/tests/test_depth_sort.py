@@ -0,0 +1,52 @@
+import random
+
+from depth_sort import draw_order, overlapping_pairs
+
+
+def brute_force(boxes):
+    return [(i, j) for i in range(len(boxes)) for j in range(i + 1, len(boxes))
+        if boxes[i][0] < boxes[j][2] and boxes[j][0] < boxes[i][2] and boxes[i][1] < boxes[j][3] and boxes[j][1] < boxes[i][3]]
+
+
+def sprite(name, x, y, z=0.0):
+    return {"name": name, "location": {"x": x, "y": y, "z": z}}
+
+
+def test_overlapping_pairs_match_brute_force():
+    rng = random.Random(5)
+    for count in (0, 1, 2, 50, 400):
+        boxes = []
+        for i in range(count):
+            x = rng.uniform(-1000, 1000)
+            y = rng.uniform(-1000, 1000)
+            # A few much larger than the grid cells, and some only touching:
+            size = rng.choice((rng.uniform(1, 100), rng.uniform(300, 800)))
+            boxes.append((x, y, x + size, y + rng.uniform(1, 100)))
+        boxes += [(0, 0, 10, 10), (10, 0, 20, 10)]
+        assert overlapping_pairs(boxes) == brute_force(boxes)
+
+
+def test_overlapping_sprites_are_ordered_back_to_front():
+    sprites = [
+        sprite("front", 2, 2),
+        sprite("back", 0, 0),
+        sprite("elsewhere", -5, 0),
+        sprite("above", 2, 2, z=1.0),
+    ]
+    boxes = [(0, 0, 10, 10), (5, 5, 15, 15), (100, 100, 110, 110), (0, 0, 10, 10)]
+    order, cycles = draw_order(sprites, boxes)
+    names = [sprites[i]["name"] for i in order]
+    assert cycles == 0
+    assert names.index("back") < names.index("front") < names.index("above")
+    # Nothing overlaps it, it comes out in the key order, the furthest back first:
+    assert names[0] == "elsewhere"
+
+
+def test_cycles_are_broken():
+    # Within the epsilon a and b, and b and c, are ordered by z, but c is a whole row in front of a:
+    sprites = [sprite("a", 0, 0, z=2.0), sprite("b", 0.6e-6, 0, z=1.0), sprite("c", 1.2e-6, 0, z=0.0)]
+    boxes = [(0, 0, 10, 10)] * 3
+    order, cycles = draw_order(sprites, boxes)
+    assert cycles == 1
+    # The backmost one breaks it, the rest follow their constraints:
+    assert order == [0, 2, 1]
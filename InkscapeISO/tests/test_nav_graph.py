@@ -0,0 +1,52 @@
+from array import array
+
+from nav_graph import EndpointSnapper, build_nav_graph
+
+
+def test_snapping_tolerance():
+    snapper = EndpointSnapper(0.01)
+    first = snapper.node(0.0, 0.0, 0.0)
+    assert snapper.node(0.009, 0.0, 0.0) == first
+    assert snapper.node(0.0, 0.0, -0.005) == first
+    assert snapper.node(0.011, 0.0, 0.0) != first
+    # The closest node wins when two are within the tolerance:
+    second = snapper.node(0.02, 0.0, 0.0)
+    assert snapper.node(0.0149, 0.0, 0.0) == second
+
+
+def test_snapping_across_cells():
+    # Either side of a cell boundary still snaps:
+    snapper = EndpointSnapper(0.5)
+    node = snapper.node(0.99, 0.99, 0.99)
+    assert snapper.node(1.01, 1.01, 1.01) == node
+    assert len(snapper.nodes) == 1
+
+
+def test_zero_tolerance_only_merges_equal_points():
+    snapper = EndpointSnapper(0.0)
+    node = snapper.node(1.0, 2.0, 3.0)
+    assert snapper.node(1.0, 2.0, 3.0) == node
+    assert snapper.node(1.0, 2.0, 3.000001) != node
+
+
+def line(start, end):
+    # A straight curve, the control points on the line:
+    points = []
+    for t in (0.0, 1.0 / 3.0, 2.0 / 3.0, 1.0):
+        points += [a + (b - a) * t for a, b in zip(start, end)]
+    return points
+
+
+def test_graph_connects_snapped_curves():
+    points = array("d", line((0, 0, 0), (1, 0, 0)) + line((1.005, 0, 0), (1, 1, 0)) + line((3, 3, 0), (4, 3, 0)))
+    directions = bytearray([1, 2, 0])
+    graph = build_nav_graph(points, directions, [0], [1], array("i", [-1, 0, -1]), ["road"], 0.01)
+
+    assert len(graph["nodes"]) == 5
+    edges = list(zip(graph["edges"]["from"], graph["edges"]["to"], graph["edges"]["curve"]))
+    # Forward, both ways, reversed:
+    assert edges == [(0, 1, 0), (1, 2, 1), (2, 1, 1), (4, 3, 2)]
+    assert graph["adjacency"][1] == [1]
+    assert graph["starts"] == [0]
+    assert graph["ends"] == [2]
+    assert abs(graph["edges"]["length"][0] - 1.0) < 1e-9
@@ -0,0 +1,61 @@
+import pytest
+
+pytest.importorskip("PIL")
+from PIL import Image
+
+import png_postprocess
+
+RED = (255, 0, 0, 255)
+HALF_BLUE = (0, 0, 255, 128)
+
+
+def write_image(filename, size, pixels):
+    image = Image.new("RGBA", size, (0, 0, 0, 0))
+    for position, color in pixels.items():
+        image.putpixel(position, color)
+    image.save(filename)
+
+
+def test_trim_keeps_the_origin_on_the_same_pixel(tmp_path):
+    filename = str(tmp_path / "tree.png")
+    # The content from (10, 20) to (29, 59), the origin at (25, 50):
+    write_image(filename, (100, 80), {(x, y): RED for x in range(10, 30) for y in range(20, 60)})
+    anchor = {"anchorX": 25 / 100, "anchorY": 50 / 80}
+
+    anchor, size, _, _ = png_postprocess.process_image(filename, anchor, trim=True, recompress=False)
+    assert size == {"width": 20, "height": 40}
+    with Image.open(filename) as image:
+        assert image.size == (20, 40)
+    assert anchor["anchorX"] * size["width"] == pytest.approx(25 - 10)
+    assert anchor["anchorY"] * size["height"] == pytest.approx(50 - 20)
+
+
+def test_fully_transparent_image_is_left_alone(tmp_path):
+    filename = str(tmp_path / "empty.png")
+    write_image(filename, (30, 10), {})
+    with open(filename, "rb") as f:
+        before = f.read()
+    anchor = {"anchorX": 0.5, "anchorY": 1.0}
+
+    result = png_postprocess.process_image(filename, anchor, trim=True, recompress=False)
+    assert result[:2] == (anchor, {"width": 30, "height": 10})
+    with open(filename, "rb") as f:
+        assert f.read() == before
+
+
+def test_quantize_keeps_the_alpha(tmp_path):
+    filename = str(tmp_path / "glass.png")
+    pixels = {(x, y): RED if x < 4 else HALF_BLUE for x in range(8) for y in range(8) if x != y}
+    write_image(filename, (8, 8), pixels)
+
+    png_postprocess.process_image(filename, {"anchorX": 0.5, "anchorY": 0.5}, trim=False, colors=16, recompress=True)
+    with Image.open(filename) as image:
+        assert image.mode == "P"
+        image = image.convert("RGBA")
+    for y in range(8):
+        for x in range(8):
+            expected = pixels.get((x, y), (0, 0, 0, 0))
+            if expected[3] == 0: # The color of the transparent pixels doesn't matter
+                assert image.getpixel((x, y))[3] == 0
+            else:
+                assert image.getpixel((x, y)) == expected
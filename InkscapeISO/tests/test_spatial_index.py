@@ -0,0 +1,69 @@
+import random
+
+import mapped_file
+import spatial_index
+from spatial_index import SpatialIndex, write_spatial_index
+
+
+def random_boxes(count, rng):
+    boxes = []
+    for i in range(count):
+        x = rng.uniform(-2000, 2000)
+        y = rng.uniform(-2000, 2000)
+        boxes.append((x, y, x + rng.uniform(0, 300), y + rng.uniform(0, 300)))
+    return boxes
+
+
+def brute_force(names, boxes, min_x, min_y, max_x, max_y):
+    return sorted(name for name, box in zip(names, boxes)
+        if box[0] <= max_x and box[1] <= max_y and box[2] >= min_x and box[3] >= min_y)
+
+
+def test_search_matches_brute_force(tmp_path):
+    rng = random.Random(7)
+    for count, node_size in ((1, 16), (15, 4), (500, 16), (1000, 5)):
+        names = ["sprite%d" % i for i in range(count)]
+        boxes = random_boxes(count, rng)
+        filename = str(tmp_path / ("index%d_%d.isos" % (count, node_size)))
+        write_spatial_index(filename, names, boxes, node_size)
+        with SpatialIndex(filename) as index:
+            assert len(index) == count
+            for query in range(50):
+                x = rng.uniform(-2500, 2500)
+                y = rng.uniform(-2500, 2500)
+                rectangle = (x, y, x + rng.uniform(0, 1500), y + rng.uniform(0, 1500))
+                assert sorted(index.search(*rectangle)) == brute_force(names, boxes, *rectangle)
+            # Everything and nothing:
+            assert sorted(index.search(-1e9, -1e9, 1e9, 1e9)) == sorted(names)
+            assert index.search(1e8, 1e8, 1e9, 1e9) == []
+
+
+def test_search_without_numpy(tmp_path, monkeypatch):
+    monkeypatch.setattr(mapped_file, "numpy", None)
+    rng = random.Random(11)
+    names = ["sprite%d" % i for i in range(200)]
+    boxes = random_boxes(len(names), rng)
+    filename = str(tmp_path / "index.isos")
+    write_spatial_index(filename, names, boxes, 8)
+    with SpatialIndex(filename) as index:
+        assert isinstance(index.boxes, memoryview)
+        rectangle = (-500, -500, 500, 500)
+        assert sorted(index.search(*rectangle)) == brute_force(names, boxes, *rectangle)
+
+
+def test_empty_index(tmp_path):
+    filename = str(tmp_path / "empty.isos")
+    write_spatial_index(filename, [], [])
+    with SpatialIndex(filename) as index:
+        assert len(index) == 0
+        assert index.search(-1e9, -1e9, 1e9, 1e9) == []
+
+
+def test_sprite_footprint_centers_the_anchor():
+    sprite = {
+        "location": {"x": 0.0, "y": 0.0, "z": 0.0},
+        "anchor": {"anchorX": 0.5, "anchorY": 1.0},
+        "size": {"width": 200, "height": 100},
+    }
+    # At 192 dpi the image is twice the size of its footprint:
+    assert spatial_index.sprite_footprint(sprite, 128, 64, 128, 192.0) == (-50.0, -50.0, 50.0, 0.0)
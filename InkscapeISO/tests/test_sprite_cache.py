@@ -0,0 +1,75 @@
+import io
+import types
+
+import inkex
+
+from iso_index import ISO_ORIGIN_TAG
+from sprite_cache import SpriteCache, appearance_hash
+
+DOCUMENT = """<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <defs>
+    <linearGradient id="stops"><stop offset="0" style="stop-color:#ff0000"/></linearGradient>
+    <linearGradient id="fill1" xlink:href="#stops"/>
+    <linearGradient id="stops2"><stop offset="0" style="stop-color:#ff0000"/></linearGradient>
+    <linearGradient id="fill2" xlink:href="#stops2"/>
+    <linearGradient id="blue"><stop offset="0" style="stop-color:#0000ff"/></linearGradient>
+  </defs>
+  <g id="tree" transform="translate(10,0)">
+    <rect width="5" height="5" style="fill:url(#fill1)"/>
+    <circle id="origin1" inkscape:label="ORIGIN" cx="2" cy="5" r="1" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"/>
+  </g>
+  <g id="tree2" transform="translate(50,20)">
+    <rect width="5" height="5" style="fill:url(#fill2)"/>
+    <circle id="origin2" inkscape:label="ORIGIN" cx="4" cy="1" r="1" xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape"/>
+  </g>
+  <g id="tree3" transform="translate(90,0)">
+    <rect width="5" height="5" style="fill:url(#blue)"/>
+  </g>
+</svg>""".replace("ORIGIN", ISO_ORIGIN_TAG)
+
+
+def test_appearance_hash_follows_definitions():
+    svg = inkex.load_svg(io.BytesIO(DOCUMENT.encode("utf-8"))).getroot()
+    digests = {}
+    hashes = {}
+    for group_id in ("tree", "tree2", "tree3"):
+        group = svg.getElementById(group_id)
+        hashes[group_id] = appearance_hash(group, group.composed_transform(), digests)
+    # Cloned gradients and a moved origin render the same, another color doesn't:
+    assert hashes["tree"] == hashes["tree2"]
+    assert hashes["tree"] != hashes["tree3"]
+
+
+def test_prune_removes_unused_outputs(tmp_path):
+    cache = SpriteCache(str(tmp_path), {"dpi": 96})
+    for filename in ("house.spr", "house.png", "old.spr", "tree.spr", "tree.png"):
+        (tmp_path / filename).write_text("")
+    cache.entries = {
+        "g1": {"hash": "1", "name": "house", "image": "house"},
+        "g2": {"hash": "2", "name": "old", "image": "tree"},
+        "g3": {"hash": "3", "name": "tree", "image": "tree"},
+    }
+    # g2 is renamed to "house#2" as a copy of the house, g3 is deleted:
+    cache.pending = {"g2": "4"}
+    cache.update({"g2": types.SimpleNamespace(name="house#2", image_name="house")})
+    cache.forget(["g3"])
+    removed = cache.prune()
+
+    assert removed == {"old", "tree"}
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["house.png", "house.spr"]
+
+
+def test_renamed_layer_makes_the_group_dirty(tmp_path):
+    svg = inkex.load_svg(io.BytesIO(DOCUMENT.encode("utf-8"))).getroot()
+    group = svg.getElementById("tree3")
+    group.name = "tree3"
+    group.layer_name = "Ground"
+    (tmp_path / "tree3.spr").write_text("")
+
+    cache = SpriteCache(str(tmp_path), {"dpi": 96}, outputs=(".spr",))
+    assert cache.is_dirty(group)
+    cache.update({"tree3": group})
+    assert not cache.is_dirty(group)
+    # The layer is relabelled, or the group moved to another layer that looks the same:
+    group.layer_name = "Roads"
+    assert cache.is_dirty(group)
@@ -0,0 +1,63 @@
+import os
+import json
+
+import sprite_manifest
+from sprite_manifest import SpriteManifest, write_manifest, read_sprite_descriptions
+
+
+def make_sprite(name):
+    return {"name": name, "layer_name": "Objects", "image": name + ".png", "location": {"x": 1.0, "y": 2.0, "z": 0.0}}
+
+
+def test_manifest_round_trip(tmp_path):
+    filename = str(tmp_path / sprite_manifest.MANIFEST_FILENAME)
+    sprites = [make_sprite(name) for name in ("tree", "tree#2", "house", "ünïcode")]
+    write_manifest(filename, sprites)
+    with SpriteManifest(filename) as manifest:
+        assert manifest.read_index() is not None
+        assert len(manifest) == len(sprites)
+        for sprite in sprites:
+            assert manifest.get(sprite["name"]) == sprite
+        assert manifest.records() == sprites
+
+
+def test_stale_index_is_rebuilt(tmp_path):
+    filename = str(tmp_path / sprite_manifest.MANIFEST_FILENAME)
+    write_manifest(filename, [make_sprite("tree"), make_sprite("house")])
+    # Same size, other content, only the checksum tells:
+    with open(filename, "r+b") as f:
+        data = f.read().replace(b"house", b"shack")
+        f.seek(0)
+        f.write(data)
+    with SpriteManifest(filename) as manifest:
+        assert manifest.read_index() is None
+        assert sorted(manifest.names()) == ["shack", "tree"]
+        assert manifest.get("shack")["image"] == "shack.png"
+
+
+def test_keep_existing_and_removed(tmp_path):
+    filename = str(tmp_path / sprite_manifest.MANIFEST_FILENAME)
+    write_manifest(filename, [make_sprite("tree"), make_sprite("house"), make_sprite("water tower")])
+    updated = dict(make_sprite("tree"), image="tree_v2.png")
+    write_manifest(filename, [updated, make_sprite("silo")], keep_existing=True, removed={"water tower"})
+    with SpriteManifest(filename) as manifest:
+        assert sorted(manifest.names()) == ["house", "silo", "tree"]
+        assert manifest.get("tree")["image"] == "tree_v2.png"
+
+
+def test_descriptions_sorted_by_name_either_way(tmp_path):
+    names = ["tree#2", "tree", "house", "tree#10"]
+    sprites = [make_sprite(name) for name in names]
+    write_manifest(str(tmp_path / sprite_manifest.MANIFEST_FILENAME), sprites)
+    for sprite in sprites:
+        with open(os.path.join(str(tmp_path), sprite["name"] + ".spr"), "w") as f:
+            json.dump(sprite, f)
+
+    from_manifest = read_sprite_descriptions(str(tmp_path), use_manifest=True)
+    from_files = read_sprite_descriptions(str(tmp_path), use_manifest=False)
+    assert [sprite["name"] for sprite in from_files] == sorted(names)
+    assert from_manifest == from_files
+
+    selected = read_sprite_descriptions(str(tmp_path), use_manifest=False, names={"tree", "missing"})
+    assert [sprite["name"] for sprite in selected] == ["tree"]
+    assert read_sprite_descriptions(str(tmp_path), use_manifest=True, names={"tree", "missing"}) == selected
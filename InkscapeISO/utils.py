@@ -1,122 +1,286 @@
 import os
 import sys
-import copy
 import tempfile
 import inkex
+import heapq
+import time
+import queue
 import subprocess
+import threading
+from instrumentation import recorder
+from iso_projection import unproject, project, unproject_many # Still used as utils.*
 
+# The Inkscape executable; can be pointed at a stub for testing.
+INKSCAPE_COMMAND = os.environ.get("INKSCAPE_COMMAND", "inkscape.exe" if os.name == "nt" else "inkscape")
 
-def unproject(position_x, position_y, iso_z, htw, hth, v_step):
-     # WolframAlpha solution path:
-        # solve a = x * p - y * p , b = x * q + y * q  - z * r for x
-        # => y = x - a/p
-        # => solve  b = x * q + (x - a/p) * q - z * r for x
-        # => x = (a*q + b*p + p*r*z) / (2 * p * q)
-        # => y = x - a/p
-        # Where:
-        # a - the x coordinate of the origin on the canvas
-        # b - the y coordinate of the origin on the canvas
-        # x - the iso_x
-        # y - the iso_y
-        # z - the iso_z (default_z)
-        # p - half tile width
-        # q - half tile height
-        # r - vertical step
-
-        # Find the location of the document space 2d point (position_x, position_y):
-        # Z component
-        # X and Y components - see above for the solution.
-        iso_x = (position_x * hth + position_y * htw + hth * v_step * iso_z) / (2 * htw * hth)
-        iso_y = iso_x - position_x / htw
-        location = {"x": iso_x, "y": iso_y, "z": iso_z}
-        return location
-
-
-
-# Make a copy of SVG document
-def write_document(document):
-    copied = copy.deepcopy(document)
-    with tempfile.NamedTemporaryFile(delete=False) as temporary_file:
-        copied.write(temporary_file)
-        return temporary_file.name
-        
-def write_svg(svg, *filename):
-    """Writes an svg to the given filename"""
-    filename = os.path.join(*filename)
-    with open(filename, "wb") as fhl:
-        if isinstance(svg, inkex.elements.SvgDocumentElement):
-            svg = inkex.elements.ElementTree(svg)
-        if hasattr(svg, "write"):
-            # XML document
-            svg.write(fhl)
-        elif isinstance(svg, bytes):
-            fhl.write(svg)
-        else:
-            raise ValueError("Not sure what type of SVG data this is.")
-    return filename
-
-def call(program, *args, **kwargs):
-    
-    subprocess_args = (program,) + args
-
-    # This is due to the issue: https://gitlab.com/inkscape/inkscape/-/issues/4875
-    if "use_cmd" in kwargs and kwargs["use_cmd"]:
-        call_args = "echo %s %s | cmd" % (program, " ".join(args))
-        result = subprocess.run(call_args, shell=True, capture_output=True)
-        return result
-    else:
-        with subprocess.Popen(
-            subprocess_args,
-            stdout=subprocess.PIPE,  # Grab any output (return it)
-            stderr=subprocess.PIPE,  # Take all errors, just incase
-            **kwargs,
-        ) as process:
-            (stdout, stderr) = process.communicate()
-            if process.returncode == 0:
-                if isinstance(stdout, bytes):
-                    return stdout.decode(sys.stdout.encoding or "utf-8")
-            raise inkex.command.ProgramRunError(program, process.returncode, stderr, stdout, args)
-
-# This is also messed up in the inkex API.
-def inkscape(svg, *args, **kwargs):
-    with tempfile.NamedTemporaryFile(prefix="inkscape_call", delete=False) as tmpfile:
-        svg_file = write_svg(svg, "", tmpfile.name)
-        stdout = call("inkscape.exe", svg_file, *args, **kwargs)
-        return stdout
-
-def get_bounding_boxes(document, groups_ids):
-    arg1 = "--query-id=%s" % (",".join(groups_ids))
-    arg2 = "--query-x" 
-    arg3 = "--query-y"
-    arg4 = "--query-width"
-    arg5 = "--query-height"
-    ret = inkscape(document, arg1, arg2, arg3, arg4, arg5)
-
-    lines = ret.split("\n")
-    xs_strs = lines[0].split(",")
-    ys_strs = lines[1].split(",")
-    widths_strs = lines[2].split(",")
-    heights_strs = lines[3].split(",")
-
-    class BoundingBox:
-        def __init__(self, x, y, w, h):
-            self.x = x
-            self.y = y
-            self.width = w
-            self.height = h
-
-        def __str__(self) -> str:
-            return "(%.4f, %.4f, %.4f, %.4f)" % (self.x, self.y, self.width, self.height)
-
-    num_groups = len(groups_ids)
-    bboxes_dict = {}
-    for i in range(0, num_groups):
-        group_id = groups_ids[i]
-        x = float(xs_strs[i])
-        y = float(ys_strs[i])
-        width = float(widths_strs[i])
-        height = float(heights_strs[i])
-        bbox = BoundingBox(x, y, width, height)
-        bboxes_dict[group_id] = bbox
-
-    return bboxes_dict
+
+class DocumentFile:
+    """The document serialized once to a temporary file, removed again on exit"""
+
+    def __init__(self, document):
+        self.document = document
+        self.filename = None
+
+    def __enter__(self):
+        handle, self.filename = tempfile.mkstemp(prefix="inkscape_iso", suffix=".svg")
+        with os.fdopen(handle, "wb") as temporary_file:
+            self.document.write(temporary_file)
+        recorder.wrote(self.filename)
+        return self.filename
+
+    def __exit__(self, *args):
+        if self.filename is not None:
+            os.remove(self.filename)
+            self.filename = None
+
+class TransformCache:
+    """Composed transforms by element, shared by all the passes of one extension run"""
+
+    def __init__(self, svg):
+        self.svg = svg
+        self.transforms = {} # A map from element to its composed transform
+        self.unit_scale = None
+
+    def fill(self, root):
+        # One walk down the groups, each transform is a single multiplication with its parent's:
+        stack = [(root, self.composed(root.getparent()))]
+        while stack:
+            element, parent_transform = stack.pop()
+            transform = parent_transform @ element.transform
+            self.transforms[element] = transform
+            for child in element.iterchildren():
+                if isinstance(child, inkex.Group):
+                    stack.append((child, transform))
+
+    def composed(self, element):
+        # Anything the fill() didn't reach is cached per ancestor as it's asked for:
+        if element is None or not isinstance(element, inkex.BaseElement):
+            return inkex.Transform()
+        transform = self.transforms.get(element)
+        if transform is None:
+            transform = self.composed(element.getparent()) @ element.transform
+            self.transforms[element] = transform
+        return transform
+
+    def invalidate(self, element):
+        # Has to be called after changing the element's transform, its whole subtree depends on it:
+        self.transforms.pop(element, None)
+        for descendant in element.iterdescendants():
+            self.transforms.pop(descendant, None)
+
+    def to_pixels(self, value):
+        # Same as svg.uutounit() for a number, which looks up the document unit on every call:
+        if self.unit_scale is None:
+            self.unit_scale = self.svg.uutounit(1.0)
+        return value * self.unit_scale
+
+
+class BoundingBox:
+    def __init__(self, x, y, w, h):
+        self.x = x
+        self.y = y
+        self.width = w
+        self.height = h
+
+    def __str__(self) -> str:
+        return "(%.4f, %.4f, %.4f, %.4f)" % (self.x, self.y, self.width, self.height)
+
+
+class InkscapeShell:
+    """A single long-lived `inkscape --shell` process with the document loaded once"""
+
+    # Inkscape prints this after every processed line of actions:
+    PROMPT = b"> "
+
+    def __init__(self, document_file, program=None, timeout=300.0):
+        self.program = program or INKSCAPE_COMMAND
+        self.document_file = document_file # Written once by DocumentFile, shared by all the sessions
+        self.timeout = timeout # Seconds a command line may take before the process is killed
+        self.process = None
+        self.stderr = None
+        self.output = None
+        self.reader = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        self.stderr = tempfile.TemporaryFile()
+        env = dict(os.environ, SELF_CALL="true")
+        start = time.perf_counter()
+        self.process = subprocess.Popen(
+            (self.program, "--shell"),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.stderr, # A file, so the warnings can't block the process
+            env=env,
+        )
+        # The output is read on a thread, so the reads can time out everywhere (no select() on Windows pipes):
+        self.output = queue.Queue()
+        self.reader = threading.Thread(target=read_chunks, args=(self.process.stdout, self.output), daemon=True)
+        self.reader.start()
+        self.read_until_prompt()
+        recorder.subprocess(time.perf_counter() - start, started=True)
+        self.run("file-open:%s" % self.document_file)
+
+    def restart(self):
+        # A fresh process after the previous one died or hung on a broken object:
+        self.close()
+        self.start()
+        recorder.count("inkscape_restarts")
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.write(b"quit\n")
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.process.wait()
+            self.reader.join(5.0)
+            self.process.stdout.close()
+            self.process = None
+            self.reader = None
+        if self.stderr is not None:
+            self.stderr.close()
+            self.stderr = None
+
+    def run(self, *actions):
+        """Runs the actions as one shell line and returns their output"""
+        line = "; ".join(actions) + "\n"
+        start = time.perf_counter()
+        try:
+            self.process.stdin.write(line.encode("utf-8"))
+            self.process.stdin.flush()
+        except OSError:
+            self.raise_error()
+        output = self.read_until_prompt()
+        recorder.subprocess(time.perf_counter() - start)
+        recorder.count("inkscape_commands")
+        return output
+
+    def read_until_prompt(self):
+        deadline = time.monotonic() + self.timeout
+        output = bytearray()
+        while not (output.endswith(b"\n" + self.PROMPT) or output == self.PROMPT):
+            try:
+                chunk = self.output.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                # Hung on something, a fresh process is cheaper than waiting forever:
+                self.process.kill()
+                recorder.count("inkscape_timeouts")
+                self.raise_error(output)
+            if not chunk:
+                self.raise_error(output)
+            output += chunk
+        output = output[:-len(self.PROMPT)]
+        return output.decode(sys.stdout.encoding or "utf-8")
+
+    def raise_error(self, stdout=b""):
+        returncode = self.process.wait()
+        self.stderr.seek(0)
+        stderr = self.stderr.read()
+        raise inkex.command.ProgramRunError(self.program, returncode, stderr, bytes(stdout), ("--shell",))
+
+    def query_bounding_box(self, object_id):
+        output = self.run("select-clear", "select-by-id:%s" % object_id, "query-x", "query-y", "query-width", "query-height")
+        # Skip anything that's not a number, Inkscape likes to print warnings in between:
+        values = []
+        for line in output.split("\n"):
+            try:
+                values.append(float(line.strip()))
+            except ValueError:
+                continue
+        if len(values) != 4:
+            raise inkex.command.ProgramRunError(self.program, None, None, output, ("query", object_id))
+        return BoundingBox(*values)
+
+    def export_object(self, object_id, filename, dpi):
+        self.export_objects([(object_id, filename, dpi)])
+
+    def export_objects(self, exports):
+        """Exports the (object id, filename, dpi) triples, all of them on one shell line"""
+        actions = []
+        for object_id, filename, dpi in exports:
+            actions += [
+                "export-id:%s" % object_id,
+                "export-id-only",
+                "export-filename:%s" % filename,
+                "export-dpi:%s" % dpi,
+                "export-do",
+            ]
+        self.run(*actions)
+
+
+def read_chunks(stdout, output):
+    # Runs on the reader thread of an InkscapeShell, an empty chunk marks the end of the output:
+    while True:
+        chunk = stdout.read1(4096)
+        output.put(chunk)
+        if not chunk:
+            return
+
+
+def balanced_shards(weights, count):
+    """Splits the keys of the weights dict into count lists of about equal total weight"""
+    shards = [[] for i in range(count)]
+    loads = [(0.0, i) for i in range(count)]
+    # Heaviest first, always onto the least loaded shard:
+    for key in sorted(weights, key=lambda key: weights[key], reverse=True):
+        load, index = heapq.heappop(loads)
+        shards[index].append(key)
+        heapq.heappush(loads, (load + weights[key], index))
+    return [shard for shard in shards if shard]
+
+
+def float_list(value):
+    """Argument type for comma separated numbers, "96, 192" is [96.0, 192.0]. Duplicates are dropped."""
+    values = []
+    for item in str(value).split(","):
+        number = float(item.strip())
+        if number <= 0:
+            raise ValueError("Not a positive number: %s" % item)
+        if number not in values:
+            values.append(number)
+    if not values:
+        raise ValueError("No numbers given")
+    return values
+
+
+def chunks(items, size):
+    """Splits the items into lists of at most size items"""
+    chunk = []
+    for item in items:
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+        chunk.append(item)
+    if chunk:
+        yield chunk
+
+
+class Progress:
+    """Thread safe "done/total" counter, printed to stderr when enabled"""
+
+    def __init__(self, total, label, enabled=True):
+        self.total = total
+        self.label = label
+        self.enabled = enabled
+        self.done = 0
+        self.lock = threading.Lock()
+
+    def advance(self, amount):
+        with self.lock:
+            self.done += amount
+            done = self.done
+        if self.enabled:
+            inkex.utils.errormsg("%s %d/%d" % (self.label, done, self.total))
+
+
+def get_bounding_boxes(session, groups_ids):
+    """The bounding boxes Inkscape reports for the groups, queried through the shell session"""
+    return {group_id: session.query_bounding_box(group_id) for group_id in groups_ids}